@@ -1,7 +1,8 @@
 import typer
-from .helpers import get_key, set_key, get_json_values, replace_lines, cur, append_lines, dec, eval_string_dec, eval_string_float
-from .ledger import ledger_load, ledger_bean
-from .ofx import ofx_load, ofx_pending, ofx_matches
+from .helpers import get_key, set_key, get_json_values, cur, append_lines, eval_string_units, Patch
+from .ledger import ledger_load, ledger_bean, ledger_reconcile
+from .ofx import ofx_pending, ofx_matches, ofx_rank
+from .statement import statement_load, statement_config
 from .prompts import resolve_toolbar, cancel_bindings, cancel_toolbar, confirm_toolbar, ValidOptions, valid_account, edit_toolbar, valid_date, valid_link_tag, is_account, postings_toolbar, valid_math_float
 from pathlib import Path
 from prompt_toolkit import prompt, HTML
@@ -38,12 +39,20 @@ def flag_callback(flag_str: str):
         raise typer.BadParameter("Invalid flag string, please enter either '*' or '!'.")
     return flag_str
 
-def get_posting(type, default_amount, default_currency, op_cur, completer, style, color):
+def period_filter(txns, period, counts):
+    for txn in txns:
+        counts['parsed'] += 1
+        if txn.date.startswith(period):
+            counts['period'] += 1
+            yield txn
+
+def get_posting(type, default_amount, precision, default_currency, op_cur, completer, style, color):
+    default_amount = cur(default_amount, precision)
     if style and color:
         type = f"<{color}>{type}</{color}>"
     account = prompt(
         HTML(f"...{type} account > "),
-        bottom_toolbar=postings_toolbar(cur(default_amount)),
+        bottom_toolbar=postings_toolbar(default_amount),
         key_bindings=cancel_bindings,
         validator=valid_account,
         completer=completer,
@@ -51,17 +60,17 @@ def get_posting(type, default_amount, default_currency, op_cur, completer, style
     if not account: return None
     amount = prompt(
         HTML(f"...{type} amount > "),
-        bottom_toolbar=postings_toolbar(cur(default_amount)),
+        bottom_toolbar=postings_toolbar(default_amount),
         key_bindings=cancel_bindings,
         validator=valid_math_float,
-        default=cur(default_amount),
+        default=default_amount,
         style=style)
     if not amount: return None
     if not op_cur:
         currency = prompt(
             HTML(f"...{type} currency > "),
             default=default_currency,
-            bottom_toolbar=postings_toolbar(cur(default_amount)),
+            bottom_toolbar=postings_toolbar(default_amount),
             key_bindings=cancel_bindings,
             style=style)
     else:
@@ -70,24 +79,31 @@ def get_posting(type, default_amount, default_currency, op_cur, completer, style
     return {"account": account, "amount": amount, "currency": currency}
 
 def bean_import(
-    ofx: Annotated[Path, typer.Argument(help="The ofx file to parse", exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True)],
+    statement: Annotated[Path, typer.Argument(help="The ofx/qfx/csv statement file to parse", exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True)],
     ledger: Annotated[Path, typer.Argument(help="The beancount ledger file to base the parser from", exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True)],
     output: Annotated[Path, typer.Option("--output", "-o", help="The output file to write to instead of stdout", show_default=False, exists=False)]=None,
-    period: Annotated[str, typer.Option("--period", "-d", help="Specify a year, month or day period to parse from the ofx file in the format YYYY, YYYY-MM or YYYY-MM-DD", callback=period_callback)]="",
-    account: Annotated[str, typer.Option("--account", "-a", help="Specify the account the ofx file belongs to", callback=account_callback)]="",
+    period: Annotated[str, typer.Option("--period", "-d", help="Specify a year, month or day period to parse from the statement file in the format YYYY, YYYY-MM or YYYY-MM-DD", callback=period_callback)]="",
+    account: Annotated[str, typer.Option("--account", "-a", help="Specify the account the statement file belongs to", callback=account_callback)]="",
     payees: Annotated[Path, typer.Option("--payees", "-p", help="The payee file to use for name substitutions", exists=False)]="payees.json",
     operating_currency: Annotated[bool, typer.Option("--operating_currency", "-c", help="Skip the currency prompt when inserting and use the ledger's operating_currency", )]=False,
-    flag: Annotated[str, typer.Option("--flag", "-f", help="Specify the default flag to set for transactions", callback=flag_callback)]="*"
+    flag: Annotated[str, typer.Option("--flag", "-f", help="Specify the default flag to set for transactions", callback=flag_callback)]="*",
+    bank: Annotated[str, typer.Option("--bank", "-b", help="The bank configuration to use for csv statements")]="",
+    banks: Annotated[Path, typer.Option("--banks", "-k", help="The json file with csv bank configurations", exists=False)]="banks.json",
+    dry_run: Annotated[bool, typer.Option("--dry-run", "-n", help="Print a unified diff of all ledger, output and payee changes instead of writing them")]=False,
+    patch: Annotated[Path, typer.Option("--patch", "-x", help="Write a unified diff of all ledger, output and payee changes to a file instead of writing them", show_default=False, exists=False)]=None,
+    atomic: Annotated[bool, typer.Option("--atomic", "-t", help="Keep all changes in memory and write them at once when finished")]=False
 ):
     """
-    Parse an OFX file based on a beancount LEDGER and output transaction entries to stdout
+    Parse a STATEMENT file (ofx, qfx or csv) based on a beancount LEDGER and output transaction entries to stdout
 
     Optionally specify an --output file.
     Optionally specify a time --period in the format YYYY, YYYY-MM or YYYY-MM-DD.
-    Optionally specify a the --account the ofx file belongs to.
+    Optionally specify a the --account the statement file belongs to.
     Optionally specify a --payees json file to use for payee name substitutions.
     Optionally skip the currency prompt when inserting and use the ledger's --operating-currency.
     Optionally set the default --flag to set for transactions. [*/!]
+    Optionally specify the --bank configuration from a --banks json file, required for csv statements.
+    Optionally print changes as a diff with --dry-run, write them to a --patch file or apply them --atomic when finished.
     """
 
     theme = Theme({
@@ -110,24 +126,20 @@ def bean_import(
 
     console = Console(theme=theme)
     err_console = Console(theme=theme, stderr=True)
-    console_output = f"OFX File: [file]{ofx}[/]\nLEDGER File: [file]{ledger}[/]\nPAYEES File: [file]{payees}[/]"
+    console_output = f"STATEMENT File: [file]{statement}[/]\nLEDGER File: [file]{ledger}[/]\nPAYEES File: [file]{payees}[/]"
     buffer = ''
 
     if output: console_output +=  f"\nOUTPUT File: [file]{output}[/]"
+    if patch: console_output +=  f"\nPATCH File: [file]{patch}[/]"
     console.print(f"{console_output}")
 
-    # Parse ofx file into ofx_data
-    ofx_data = ofx_load(err_console, ofx)
-    if ofx_data and len(ofx_data.transactions):
-        console.print(f"Parsed [number]{len(ofx_data.transactions)}[/] transactions from OFX file")
-    else:
-        err_console.print(f"[warning]No transactions found in OFX file. Exiting.[/]")
-        raise typer.Exit()
+    # Keep file changes in memory when only showing or saving them as a diff, or applying them at once
+    file_patch = Patch() if dry_run or patch or atomic else None
 
     # Parse ledger file into ledger_data
-    ledger_data = ledger_load(err_console, ledger)
-    if ledger_data and len(ledger_data.transactions):
-        console.print(f"Parsed [number]{len(ledger_data.transactions)}[/] beans from LEDGER file")
+    ledger_data = ledger_load(err_console, ledger, file_patch)
+    if ledger_data and len(ledger_data.entry_files):
+        console.print(f"Parsed [number]{len(ledger_data.entry_files)}[/] beans from LEDGER file")
         console.print(f"Default currency: [answer]{ledger_data.currency}[/]")
     else:
         err_console.print(f"[warning]No transaction entries found in LEDGER file. Exiting.[/]")
@@ -136,27 +148,38 @@ def bean_import(
     tags_completer = FuzzyCompleter(WordCompleter(ledger_data.tags))
     links_completer = FuzzyCompleter(WordCompleter(ledger_data.links))
 
-    # Filter transactions by dates specified from cli
-    if period:
-        filtered = [t for t in ofx_data.transactions if t.date.startswith(period)]
-        if len(filtered):
-            console.print(f"Found [number]{len(filtered)}[/] transactions within period [date]{period}[/]")
-        else:
-            err_console.print(f"[warning]No transactions found within the specified period [date]{period}[/]. Exiting.[/]")
-            raise typer.Exit()
-    else:
-        filtered = ofx_data.transactions
+    # Load statement file into ofx_data using the ledger's currency precisions, transactions are streamed while matching pending
+    ofx_data = statement_load(err_console, statement, statement_config(err_console, banks, bank), ledger_data.currency, ledger_data.precisions)
+    if not ofx_data:
+        err_console.print(f"[warning]No transactions found in STATEMENT file. Exiting.[/]")
+        raise typer.Exit()
 
     # Check if account specified, else prompt
     if not account:
         account = prompt(
-            f"Beancount account OFX belongs to > ",
+            f"Beancount account STATEMENT belongs to > ",
             validator=valid_account,
             completer=account_completer)
-    console.print(f"OFX file using account: [answer]{account}[/]")
-
-    # Match transactions not in beans into pending
-    pending = ofx_pending(filtered, ledger_data.transactions, account)
+    console.print(f"STATEMENT file using account: [answer]{account}[/]")
+
+    # Filter transactions by dates specified from cli and match those not in beans into pending
+    counts = {'parsed': 0, 'period': 0}
+    try:
+        pending = ofx_pending(period_filter(ofx_data.transactions, period, counts), ledger_data.recs, account)
+    except Exception as e:
+        err_console.print(f"[error]Error parsing statement file: {str(e)}[/]")
+        raise typer.Exit()
+    if counts['parsed']:
+        console.print(f"Parsed [number]{counts['parsed']}[/] transactions from STATEMENT file")
+    else:
+        err_console.print(f"[warning]No transactions found in STATEMENT file. Exiting.[/]")
+        raise typer.Exit()
+    if period:
+        if counts['period']:
+            console.print(f"Found [number]{counts['period']}[/] transactions within period [date]{period}[/]")
+        else:
+            err_console.print(f"[warning]No transactions found within the specified period [date]{period}[/]. Exiting.[/]")
+            raise typer.Exit()
     if len(pending):
         console.print(f"Found [number]{len(pending)}[/] transactions not in LEDGER")
     else:
@@ -165,288 +188,311 @@ def bean_import(
     # Parse each pending transaction
     reconcile_count = 0
     insert_count = 0
-    for txn_count, txn in enumerate(pending):
-        console.print(f"Parsing {txn_count+1}/{len(pending)}: {txn.print(theme=True)}")
-
-        # Update ledger data for every transaction
-        ledger_data = ledger_load(err_console, ledger)
-        account_completer = FuzzyCompleter(WordCompleter(ledger_data.accounts, sentence=True))
-        tags_completer = FuzzyCompleter(WordCompleter(ledger_data.tags))
-        links_completer = FuzzyCompleter(WordCompleter(ledger_data.links))
-
-        # Reconcile, Insert, Skip?
-        resolve = prompt(
-            f"...Reconcile, Insert or Skip? > ",
-            bottom_toolbar=resolve_toolbar,
-            validator=ValidOptions(['r', 'reconcile', 'i', 'insert', 's', 'skip', 'q', 'quit'])).lower()
-
-        # Reconcile
-        if resolve[0] == "r":
-            console.print(f"...Reconciling")
-            reconcile_matches = ofx_matches(txn, ledger_data.transactions, account)
-
-            # Matches found
-            matches_canceled = False
-            if len(reconcile_matches):
-                console.print(f"...Found matches:\n")
-                for i, match in enumerate(reconcile_matches):
-                    post_match = None
-                    for post in match.entry.postings:
-                        if post.account == account:
-                            post_match = post
-                            break
-                    console.print(f"   [{i}] {match.print_head(theme=True)}")
-                    console.print(f"          {post_match.account} {post_match.units.number}")
-                if len(reconcile_matches) == 1:
-                    match_range = '[0]'
-                else:
-                    match_range = f'[0-{len(reconcile_matches) - 1}]'
-                reconcile_match = prompt(
-                    f"\n...Select match {match_range} > ",
-                    bottom_toolbar=cancel_toolbar,
-                    key_bindings=cancel_bindings,
-                    validator=ValidOptions([str(n) for n in range(len(reconcile_matches))]),
-                    default="0")
-                if reconcile_match:
-                    bean_reconcile = reconcile_matches[int(reconcile_match)]
-                    bean_linecount = len(bean_reconcile.print().strip().split('\n'))
-                    console.print(f"...Reconciling {bean_reconcile.print_head(theme=True)}\n")
-                    for post in bean_reconcile.entry.postings:
-                        if post.account == account:
-                            post.meta.update({'rec': txn.id})
-                            break
-                    replace_lines(
-                        err_console,
-                        bean_reconcile.entry.meta['filename'],
-                        bean_reconcile.print().strip(),
-                        bean_reconcile.entry.meta['lineno'],
-                        bean_linecount)
-                    console.print(bean_reconcile.print())
-                    reconcile_count += 1
-                else: matches_canceled = True
-            else: matches_canceled = True
-            # No matches found
-            if matches_canceled:
-                reconcile_insert = prompt(
-                    f"...No matching transactions found. Would you like to insert instead? [Y/n] > ",
-                    default='y',
-                    bottom_toolbar=confirm_toolbar,
-                    validator=ValidOptions(['y', 'n'])).lower()
-                if reconcile_insert == 'y': resolve = 'i'
-                else: resolve = 's'
-
-        # Insert
-        if resolve[0] == "i":
-            console.print(f"...Inserting")
-
-            # Replace payee
-            payees_set = sorted(set(get_json_values(payees)).union(ledger_data.payees))
-            payee_completer = FuzzyCompleter(WordCompleter(payees_set, sentence=True))
-            payee = get_key(payees, txn.payee)
-
-            # Payee not found, replace
-            if not payee:
-                payee = prompt(
-                    f"...Replace '{txn.payee}'? > ",
-                    key_bindings=cancel_bindings,
-                    bottom_toolbar=cancel_toolbar,
-                    completer=payee_completer)
-
-            # Payee entered
-            if payee:
-                console.print(f"...Replaced [string]{txn.payee}[/] with [answer]{payee}[/]")
-                set_key(payees, txn.payee, payee)
-                txn.payee = payee
-
-            # Update total transaction amount
-            new_amount = txn.abs_amount
-            new_amount = prompt(
-                f"...Update total amount? > ",
-                key_bindings=cancel_bindings,
-                bottom_toolbar=cancel_toolbar,
-                validator=valid_math_float,
-                default=cur(new_amount)
-            )
-            if new_amount:
-                new_amount = eval_string_float(console, new_amount)
-
-            # Add credit postings until total is equal to transaction amount
-            new_bean = ledger_bean(txn, ofx_data.account_id, flag)
-            new_posting = None
-            while new_bean.amount < new_amount:
-                console.print(f"\n{new_bean.print()}")
-                new_posting = get_posting("Credit", new_amount - new_bean.amount, ledger_data.currency, operating_currency, account_completer, style, "pos")
-                if new_posting is not None:
-                    new_posting['amount'] = eval_string_dec(console, new_posting['amount'])
-                    new_bean.add_posting(new_posting)
-                else:
-                    break
-
-            # Add debit posting
-            if new_posting is not None:
-                console.print(f"\n{new_bean.print()}")
-                new_posting = get_posting("Debit", new_amount * -1, ledger_data.currency, operating_currency, account_completer, style, "neg")
-                if new_posting is not None:
-                    new_posting['amount'] = eval_string_dec(console, new_posting['amount'])
-                    new_bean.add_posting(new_posting)
-
-            # Edit final
-            edit_cancelled = False
-            while True:
-                console.print(f"\n{new_bean.print()}")
-                edit_option = prompt(
-                    f"...Edit transaction? > ",
-                    validator=ValidOptions(['d', 'date', 'f', 'flag', 'p', 'payee', 'n', 'narration', 't', 'tags', 'l', 'links', 'o', 'postings', 's', 'save']),
-                    bottom_toolbar=edit_toolbar,
-                    key_bindings=cancel_bindings)
-
-                if edit_option is None:
-                    edit_cancelled = True
-                    break
-
-                # Edit date
-                if edit_option[0] == 'd':
-                    edit_date = prompt(
-                        f"...Enter a new date (YYYY-MM-DD) > ",
-                        validator=valid_date,
-                        key_bindings=cancel_bindings,
-                        bottom_toolbar=cancel_toolbar)
-                    if edit_date:
-                        new_bean.update(date=edit_date)
-                    continue
-
-                # Edit flag
-                if edit_option[0] == 'f':
-                    edit_flag = prompt(
-                        f"...Enter a new flag [!/*] > ",
-                        validator=ValidOptions(['*', '!']),
-                        key_bindings=cancel_bindings,
-                        bottom_toolbar=cancel_toolbar)
-                    if edit_flag:
-                        new_bean.update(flag=edit_flag)
-                    continue
-
-                # Edit payee
-                if edit_option[0] == 'p':
-                    edit_payee = prompt(
-                        f"...Enter new payee > ",
-                        key_bindings=cancel_bindings,
-                        bottom_toolbar=cancel_toolbar,
-                        completer=payee_completer)
-                    if edit_payee:
-                        new_bean.update(payee=edit_payee)
-                    continue
-
-                # Edit narration
-                if edit_option[0] == 'n':
-                    edit_narration = prompt(
-                        f"...Enter new narration > ",
-                        key_bindings=cancel_bindings,
-                        bottom_toolbar=cancel_toolbar)
-                    if edit_narration:
-                        new_bean.update(narration=edit_narration)
-                    continue
-
-                # Edit tags
-                if edit_option[0] == 't':
-                    edit_tags = prompt(
-                        f"...Enter a list of tags separated by spaces > ",
-                        key_bindings=cancel_bindings,
+    interrupted = False
+    try:
+        for txn_count, txn in enumerate(pending):
+            console.print(f"Parsing {txn_count+1}/{len(pending)}: {txn.print(theme=True)}")
+
+            # Update ledger data when an included file changed, unless edits are kept in memory against the old lines
+            changed = ledger_data.changed()
+            if changed and file_patch is not None and file_patch.files:
+                err_console.print(f"[error]LEDGER changed outside of bean-import while changes are kept in memory: {', '.join(f'[file]{f}[/]' for f in changed)}. Stopping[/]")
+                break
+            if changed:
+                ledger_data = ledger_load(err_console, ledger, file_patch)
+                account_completer = FuzzyCompleter(WordCompleter(ledger_data.accounts, sentence=True))
+                tags_completer = FuzzyCompleter(WordCompleter(ledger_data.tags))
+                links_completer = FuzzyCompleter(WordCompleter(ledger_data.links))
+
+            # Reconcile, Insert, Skip?
+            resolve = prompt(
+                f"...Reconcile, Insert or Skip? > ",
+                bottom_toolbar=resolve_toolbar,
+                validator=ValidOptions(['r', 'reconcile', 'i', 'insert', 's', 'skip', 'q', 'quit'])).lower()
+
+            # Reconcile
+            if resolve[0] == "r":
+                console.print(f"...Reconciling")
+                reconcile_matches = ofx_rank(txn, ofx_matches(txn, ledger_data, account))
+
+                # Matches found
+                matches_canceled = False
+                if len(reconcile_matches):
+                    console.print(f"...Found matches:\n")
+                    for i, match in enumerate(reconcile_matches):
+                        post_match = None
+                        for post in match.entry.postings:
+                            if post.account == account:
+                                post_match = post
+                                break
+                        console.print(f"   [{i}] {match.print_head(theme=True)}")
+                        console.print(f"          {post_match.account} {post_match.units.number:f}")
+                    if len(reconcile_matches) == 1:
+                        match_range = '[0]'
+                    else:
+                        match_range = f'[0-{len(reconcile_matches) - 1}]'
+                    reconcile_match = prompt(
+                        f"\n...Select match {match_range} > ",
                         bottom_toolbar=cancel_toolbar,
-                        validator=valid_link_tag,
-                        completer=tags_completer,
-                        default=" ".join(new_bean.entry.tags))
-                    if edit_tags:
-                        new_bean.update(tags=set(edit_tags.split()))
-                    continue
-
-                # Edit links
-                if edit_option[0] == 'l':
-                    edit_links = prompt(
-                        f"...Enter a list of links separated by spaces > ",
                         key_bindings=cancel_bindings,
-                        bottom_toolbar=cancel_toolbar,
-                        validator=valid_link_tag,
-                        completer=links_completer,
-                        default=" ".join(new_bean.entry.links))
-                    if edit_links:
-                        new_bean.update(links=set(edit_links.split()))
-                    continue
-
-                # Edit postings
-                if edit_option[0] == 'o':
-                    new_bean.update(postings=[])
-                    # Update total transaction amount
-                    new_amount = prompt(
-                        f"...Update total amount? > ",
+                        validator=ValidOptions([str(n) for n in range(len(reconcile_matches))]),
+                        default="0")
+                    if reconcile_match:
+                        bean_reconcile = reconcile_matches[int(reconcile_match)]
+                        console.print(f"...Reconciling {bean_reconcile.print_head(theme=True)}\n")
+                        if ledger_reconcile(err_console, ledger_data, bean_reconcile, account, txn.id, file_patch):
+                            console.print(bean_reconcile.print())
+                            reconcile_count += 1
+                        else: matches_canceled = True
+                    else: matches_canceled = True
+                else: matches_canceled = True
+                # No matches found
+                if matches_canceled:
+                    reconcile_insert = prompt(
+                        f"...No matching transactions found. Would you like to insert instead? [Y/n] > ",
+                        default='y',
+                        bottom_toolbar=confirm_toolbar,
+                        validator=ValidOptions(['y', 'n'])).lower()
+                    if reconcile_insert == 'y': resolve = 'i'
+                    else: resolve = 's'
+
+            # Insert
+            if resolve[0] == "i":
+                console.print(f"...Inserting")
+
+                # Replace payee
+                payees_set = sorted(set(get_json_values(payees, file_patch)).union(ledger_data.payees))
+                payee_completer = FuzzyCompleter(WordCompleter(payees_set, sentence=True))
+                payee = get_key(payees, txn.payee, file_patch)
+
+                # Payee not found, replace
+                if not payee:
+                    payee = prompt(
+                        f"...Replace '{txn.payee}'? > ",
                         key_bindings=cancel_bindings,
                         bottom_toolbar=cancel_toolbar,
-                        validator=valid_math_float,
-                        default=cur(new_amount)
-                    )
-                    if new_amount:
-                        new_amount = eval_string_float(console, new_amount)
-                    while new_bean.amount < new_amount:
-                        console.print(f"\n{new_bean.print()}")
-                        new_posting = get_posting("Credit", new_amount - new_bean.amount, ledger_data.currency, operating_currency, account_completer, style, "pos")
-                        if new_posting is not None:
-                            new_posting['amount'] = eval_string_dec(console, new_posting['amount'])
-                            new_bean.add_posting(new_posting)
+                        completer=payee_completer)
+
+                # Payee entered
+                if payee:
+                    console.print(f"...Replaced [string]{txn.payee}[/] with [answer]{payee}[/]")
+                    set_key(payees, txn.payee, payee, file_patch)
+                    txn.payee = payee
+
+                # Update total transaction amount
+                new_amount = txn.abs_amount
+                new_amount = prompt(
+                    f"...Update total amount? > ",
+                    key_bindings=cancel_bindings,
+                    bottom_toolbar=cancel_toolbar,
+                    validator=valid_math_float,
+                    default=cur(new_amount, txn.precision)
+                )
+                if new_amount:
+                    new_amount = eval_string_units(console, new_amount, txn.precision)
+
+                # Add credit postings until total is equal to transaction amount
+                new_bean = ledger_bean(txn, ofx_data.account_id, flag, ledger_data.precisions)
+                new_posting = None
+                while new_bean.amount < new_amount:
                     console.print(f"\n{new_bean.print()}")
-                    new_posting = get_posting("Debit", new_amount * -1, ledger_data.currency, operating_currency, account_completer, style, "neg")
+                    new_posting = get_posting("Credit", new_amount - new_bean.amount, new_bean.precision, ledger_data.currency, operating_currency, account_completer, style, "pos")
                     if new_posting is not None:
-                        new_posting['amount'] = eval_string_dec(console, new_posting['amount'])
+                        new_posting['amount'] = eval_string_units(console, new_posting['amount'], new_bean.currency_precision(new_posting['currency']))
                         new_bean.add_posting(new_posting)
-                    continue
-
-                # Save and finish
-                if edit_option[0] == 's' or edit_option == '':
-                    console.print(f"...Finished editing")
-                    break
-
-            # Post entry to output (if stdout, save to string)
-            if not edit_cancelled:
-
-                # Add rec meta to account
-                found_account = False
-                for post in new_bean.entry.postings:
-                    if post.account == account:
-                        found_account = True
-                        post.meta.update({'rec': txn.id})
-                        break
-                if not found_account:
-                    no_account_found = prompt(
-                        HTML(f"...OFX account <pos>{account}</pos> not found, continue anyways? [Y/n] > "),
-                        default='y',
-                        bottom_toolbar=confirm_toolbar,
-                        validator=ValidOptions(['y', 'n']),
-                        style=style).lower()
-                    if no_account_found == 'n':
-                        console.print(f"...Skipping")
-                        found_account = False
                     else:
-                        found_account = True
+                        break
 
-                if found_account:
-                    if output:
-                        console_insert = f'[file]{output}[/]'
-                        append_lines(err_console, output, new_bean.print())
-                    else:
-                        console_insert = f'[file]buffer[/]'
-                        buffer += f"\n{new_bean.print()}"
-                    console.print(f"...Inserted {new_bean.print_head(theme=True)} into {console_insert}")
+                # Add debit posting
+                if new_posting is not None:
                     console.print(f"\n{new_bean.print()}")
-                    insert_count += 1
+                    new_posting = get_posting("Debit", new_amount * -1, new_bean.precision, ledger_data.currency, operating_currency, account_completer, style, "neg")
+                    if new_posting is not None:
+                        new_posting['amount'] = eval_string_units(console, new_posting['amount'], new_bean.currency_precision(new_posting['currency']))
+                        new_bean.add_posting(new_posting)
 
-        # Skip transaction
-        if resolve[0] == "s":
-            console.print(f"...Skipping")
+                # Edit final
+                edit_cancelled = False
+                while True:
+                    console.print(f"\n{new_bean.print()}")
+                    edit_option = prompt(
+                        f"...Edit transaction? > ",
+                        validator=ValidOptions(['d', 'date', 'f', 'flag', 'p', 'payee', 'n', 'narration', 't', 'tags', 'l', 'links', 'o', 'postings', 's', 'save']),
+                        bottom_toolbar=edit_toolbar,
+                        key_bindings=cancel_bindings)
+
+                    if edit_option is None:
+                        edit_cancelled = True
+                        break
 
-        # Quit
-        if resolve[0] == "q":
-            break
+                    # Edit date
+                    if edit_option[0] == 'd':
+                        edit_date = prompt(
+                            f"...Enter a new date (YYYY-MM-DD) > ",
+                            validator=valid_date,
+                            key_bindings=cancel_bindings,
+                            bottom_toolbar=cancel_toolbar)
+                        if edit_date:
+                            new_bean.update(date=edit_date)
+                        continue
+
+                    # Edit flag
+                    if edit_option[0] == 'f':
+                        edit_flag = prompt(
+                            f"...Enter a new flag [!/*] > ",
+                            validator=ValidOptions(['*', '!']),
+                            key_bindings=cancel_bindings,
+                            bottom_toolbar=cancel_toolbar)
+                        if edit_flag:
+                            new_bean.update(flag=edit_flag)
+                        continue
+
+                    # Edit payee
+                    if edit_option[0] == 'p':
+                        edit_payee = prompt(
+                            f"...Enter new payee > ",
+                            key_bindings=cancel_bindings,
+                            bottom_toolbar=cancel_toolbar,
+                            completer=payee_completer)
+                        if edit_payee:
+                            new_bean.update(payee=edit_payee)
+                        continue
+
+                    # Edit narration
+                    if edit_option[0] == 'n':
+                        edit_narration = prompt(
+                            f"...Enter new narration > ",
+                            key_bindings=cancel_bindings,
+                            bottom_toolbar=cancel_toolbar)
+                        if edit_narration:
+                            new_bean.update(narration=edit_narration)
+                        continue
+
+                    # Edit tags
+                    if edit_option[0] == 't':
+                        edit_tags = prompt(
+                            f"...Enter a list of tags separated by spaces > ",
+                            key_bindings=cancel_bindings,
+                            bottom_toolbar=cancel_toolbar,
+                            validator=valid_link_tag,
+                            completer=tags_completer,
+                            default=" ".join(new_bean.entry.tags))
+                        if edit_tags:
+                            new_bean.update(tags=set(edit_tags.split()))
+                        continue
+
+                    # Edit links
+                    if edit_option[0] == 'l':
+                        edit_links = prompt(
+                            f"...Enter a list of links separated by spaces > ",
+                            key_bindings=cancel_bindings,
+                            bottom_toolbar=cancel_toolbar,
+                            validator=valid_link_tag,
+                            completer=links_completer,
+                            default=" ".join(new_bean.entry.links))
+                        if edit_links:
+                            new_bean.update(links=set(edit_links.split()))
+                        continue
+
+                    # Edit postings
+                    if edit_option[0] == 'o':
+                        new_bean.update(postings=[])
+                        # Update total transaction amount
+                        new_amount = prompt(
+                            f"...Update total amount? > ",
+                            key_bindings=cancel_bindings,
+                            bottom_toolbar=cancel_toolbar,
+                            validator=valid_math_float,
+                            default=cur(new_amount, txn.precision)
+                        )
+                        if new_amount:
+                            new_amount = eval_string_units(console, new_amount, txn.precision)
+                        while new_bean.amount < new_amount:
+                            console.print(f"\n{new_bean.print()}")
+                            new_posting = get_posting("Credit", new_amount - new_bean.amount, new_bean.precision, ledger_data.currency, operating_currency, account_completer, style, "pos")
+                            if new_posting is not None:
+                                new_posting['amount'] = eval_string_units(console, new_posting['amount'], new_bean.currency_precision(new_posting['currency']))
+                                new_bean.add_posting(new_posting)
+                        console.print(f"\n{new_bean.print()}")
+                        new_posting = get_posting("Debit", new_amount * -1, new_bean.precision, ledger_data.currency, operating_currency, account_completer, style, "neg")
+                        if new_posting is not None:
+                            new_posting['amount'] = eval_string_units(console, new_posting['amount'], new_bean.currency_precision(new_posting['currency']))
+                            new_bean.add_posting(new_posting)
+                        continue
 
-    # Finished parsing
+                    # Save and finish
+                    if edit_option[0] == 's' or edit_option == '':
+                        console.print(f"...Finished editing")
+                        break
+
+                # Post entry to output (if stdout, save to string)
+                if not edit_cancelled:
+
+                    # Add rec meta to account
+                    found_account = False
+                    for post in new_bean.entry.postings:
+                        if post.account == account:
+                            found_account = True
+                            post.meta.update({'rec': txn.id})
+                            break
+                    if not found_account:
+                        no_account_found = prompt(
+                            HTML(f"...STATEMENT account <pos>{account}</pos> not found, continue anyways? [Y/n] > "),
+                            default='y',
+                            bottom_toolbar=confirm_toolbar,
+                            validator=ValidOptions(['y', 'n']),
+                            style=style).lower()
+                        if no_account_found == 'n':
+                            console.print(f"...Skipping")
+                            found_account = False
+                        else:
+                            found_account = True
+
+                    if found_account:
+                        if output:
+                            console_insert = f'[file]{output}[/]'
+                            append_lines(err_console, output, new_bean.print(), file_patch)
+                        else:
+                            console_insert = f'[file]buffer[/]'
+                            buffer += f"\n{new_bean.print()}"
+                        console.print(f"...Inserted {new_bean.print_head(theme=True)} into {console_insert}")
+                        console.print(f"\n{new_bean.print()}")
+                        insert_count += 1
+
+            # Skip transaction
+            if resolve[0] == "s":
+                console.print(f"...Skipping")
+
+            # Quit
+            if resolve[0] == "q":
+                break
+    except KeyboardInterrupt:
+        console.print(f"\n[warning]Interrupted[/]")
+        interrupted = True
+
+    # Finished parsing, write or show changes kept in memory
+    if file_patch is not None:
+        diff = file_patch.diff(ledger.parent)
+        if dry_run:
+            console.print(diff, markup=False, highlight=False, soft_wrap=True, end='')
+        if patch:
+            with open(patch, 'w', encoding='utf-8', newline='\n') as file:
+                file.write(diff)
+            console.print(f"...Wrote changes to [file]{patch}[/]")
+        if atomic and not dry_run and not patch and diff:
+            # Only apply changes made before an interrupt when confirmed, a second interrupt keeps them unapplied
+            apply_changes = 'y'
+            if interrupted:
+                try:
+                    apply_changes = prompt(
+                        f"...Apply the changes made before the interrupt? [y/N] > ",
+                        default='n',
+                        bottom_toolbar=confirm_toolbar,
+                        validator=ValidOptions(['y', 'n'])).lower()
+                except (KeyboardInterrupt, EOFError):
+                    apply_changes = 'n'
+            if apply_changes == 'y' and file_patch.apply(err_console): console.print(f"...Applied all changes")
+            else: file_patch.save(err_console, ledger.parent)
     if not output and buffer:
         console.print(f"{buffer}")
     if reconcile_count:
@@ -1,8 +1,17 @@
 import typer
 from .bean_import import bean_import
+from .server import serve
+from .watch import watch
 
 app = typer.Typer()
 app.command()(bean_import)
 
+# Separate entry points keep `bean-import STATEMENT LEDGER` working
+serve_app = typer.Typer()
+serve_app.command()(serve)
+
+watch_app = typer.Typer()
+watch_app.command()(watch)
+
 if __name__ == "__main__":
     app()
@@ -1,42 +1,143 @@
-import json, os, re
+import difflib, json, os, re, tempfile
 from decimal import Decimal, ROUND_HALF_UP
 
-def cur(num): return '{:.2f}'.format(float(num))
+def to_units(num, precision=2):
+    if not isinstance(num, Decimal): num = Decimal(str(num))
+    return int(num.scaleb(precision).to_integral_value(rounding=ROUND_HALF_UP))
 
-def dec(num, dec='0.01'): return Decimal(num).quantize(Decimal(dec), rounding=ROUND_HALF_UP)
+def from_units(units, precision=2): return Decimal(units).scaleb(-precision)
 
-def get_key(json_path, key):
-    data = get_json(json_path)
+def cur(units, precision=2): return f'{from_units(units, precision):f}'
+
+def decimal_places(num):
+    exponent = Decimal(str(num)).as_tuple().exponent
+    return -exponent if isinstance(exponent, int) and exponent < 0 else 0
+
+def precision_of(precisions, currency): return precisions.get(currency, 2) if precisions else 2
+
+def get_key(json_path, key, patch=None):
+    data = get_json(json_path, patch)
     if key in data: return data[key]
     else: return None
 
-def set_key(json_path, key, value):
-    data = get_json(json_path)
+def set_key(json_path, key, value, patch=None):
+    data = get_json(json_path, patch)
     data[key] = value
-    set_json(data, json_path)
+    set_json(data, json_path, patch)
 
-def set_json(data, json_path):
+def set_json(data, json_path, patch=None):
+    text = json.dumps(data, indent=4, sort_keys=True, ensure_ascii=False)
+    if patch is not None:
+        patch.write(json_path, text)
+        return
     with open(json_path, 'w', encoding='utf-8', newline='\n') as file:
-        json.dump(data, file, indent=4, sort_keys=True, ensure_ascii=False)
+        file.write(text)
+
+def get_json(json_path, patch=None):
+    # Files kept in a patch are read back from it, and never created or reset on disk
+    text = ''
+    if patch is not None and str(json_path) in patch.files:
+        text = ''.join(patch.lines(json_path))
+    elif os.path.exists(json_path):
+        with open(json_path, 'r', encoding='utf-8') as file:
+            text = file.read()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        # If file is missing, empty or invalid, initialize with empty dict
+        data = {}
+        if patch is None: set_json(data, json_path)
+        return data
+
+def get_json_values(json_path, patch=None):
+    return list(get_json(json_path, patch).values())
+
+class Patch:
+    def __init__(self):
+        # Edited files by path: (mtime when first read, original lines, edited lines)
+        self.files = {}
+
+    def lines(self, file_path):
+        file_path = str(file_path)
+        if file_path not in self.files:
+            lines = []
+            if os.path.exists(file_path):
+                with open(file_path, 'r', encoding='utf-8') as file:
+                    lines = file.readlines()
+            self.files[file_path] = (file_mtime(file_path), lines, list(lines))
+        return self.files[file_path][2]
+
+    def replace(self, file_path, new_data_arr, line_start, line_count=1):
+        lines = self.lines(file_path)
+        lines[line_start - 1:line_start + line_count - 1] = new_data_arr
+
+    def append(self, file_path, new_data):
+        # Same as appending f"\n{new_data}" to the file, without re-splitting the lines already held
+        lines = self.lines(file_path)
+        if lines and not lines[-1].endswith('\n'): lines[-1] += '\n'
+        else: lines.append('\n')
+        new_lines = new_data.split('\n')
+        lines.extend(line + '\n' for line in new_lines[:-1])
+        if new_lines[-1]: lines.append(new_lines[-1])
 
-def get_json(json_path):
-    data = {}
-    if not os.path.exists(json_path):
-        set_json(data, json_path)
-    with open(json_path, 'r', encoding='utf-8') as file:
+    def write(self, file_path, text):
+        # Replace every line, only newlines end lines
+        new_lines = text.split('\n')
+        lines = self.lines(file_path)
+        lines[:] = [line + '\n' for line in new_lines[:-1]]
+        if new_lines[-1]: lines.append(new_lines[-1])
+
+    def diff(self, base='.'):
+        diff = ''
+        for file_path, (mtime, original, lines) in sorted(self.files.items()):
+            if original == lines: continue
+            rel_path = os.path.relpath(file_path, base).replace(os.sep, '/')
+            from_path = f"a/{rel_path}" if mtime is not None else '/dev/null'
+            for line in difflib.unified_diff(original, lines, from_path, f"b/{rel_path}"):
+                diff += line if line.endswith('\n') else f"{line}\n\\ No newline at end of file\n"
+        return diff
+
+    def save(self, console, base='.'):
+        # Keep changes that could not be written as a diff file in base, or print them when that fails too
+        diff = self.diff(base)
         try:
-            data = json.load(file)
-        except json.JSONDecodeError:
-            # If file is empty or invalid, initialize with empty dict
-            set_json(data, json_path)
-    return data
+            fd, diff_path = tempfile.mkstemp(dir=base, prefix='bean-import-', suffix='.diff')
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as file:
+                file.write(diff)
+        except Exception as e:
+            console.print(f"[error]<<ERROR>> Error saving changes: {str(e)}[/]")
+            console.print(diff, markup=False, highlight=False, soft_wrap=True, end='')
+            return None
+        console.print(f"[warning]Saved changes to [file]{diff_path}[/], apply them from [file]{base}[/] with `git apply` or `patch -p1`[/]")
+        return diff_path
 
-def get_json_values(json_path):
-    return list(get_json(json_path).values())
+    def apply(self, console):
+        # Write every file to a temporary file first, then move them all into place
+        temps = []
+        try:
+            for file_path, (mtime, original, lines) in self.files.items():
+                if original == lines: continue
+                if file_mtime(file_path) != mtime:
+                    raise Exception(f"File {file_path} changed since it was read")
+                fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file_path)), prefix='.bean-import-')
+                temps.append((temp_path, file_path))
+                with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as file:
+                    file.writelines(lines)
+                if os.path.exists(file_path): os.chmod(temp_path, os.stat(file_path).st_mode)
+        except Exception as e:
+            for temp_path, file_path in temps: os.remove(temp_path)
+            console.print(f"[error]<<ERROR>> Error applying changes: {str(e)}[/]")
+            return False
+        for temp_path, file_path in temps:
+            os.replace(temp_path, file_path)
+        return True
 
-def replace_lines(console, file_path, new_data, line_start, line_count=1):
+def replace_lines(console, file_path, new_data, line_start, line_count=1, patch=None):
     new_data_arr = [l + '\n' for l in new_data.split('\n')]
     try:
+        if patch is not None:
+            patch.replace(file_path, new_data_arr, line_start, line_count)
+            return True
         with open(file_path, 'r', encoding='utf-8') as file:
             lines = file.readlines()
         new_lines = lines[:line_start - 1] + new_data_arr + lines[line_start + line_count - 1:]
@@ -47,8 +148,11 @@ def replace_lines(console, file_path, new_data, line_start, line_count=1):
         console.print(f"[error]<<ERROR>> Error replacing lines: {str(e)}[/]")
         return False
 
-def append_lines(console, file_path, new_data):
+def append_lines(console, file_path, new_data, patch=None):
     try:
+        if patch is not None:
+            patch.append(file_path, new_data)
+            return True
         with open(file_path, 'a', encoding='utf-8', newline='\n') as file:
             file.write(f"\n{new_data}")
         return True
@@ -56,23 +160,29 @@ def append_lines(console, file_path, new_data):
         console.print(f"[error]<<ERROR>> Error inserting lines: {str(e)}[/]")
         return False
 
+def file_mtime(file_path):
+    try:
+        return os.stat(file_path).st_mtime_ns
+    except OSError:
+        return None
+
 def del_spaces(text):
     return re.sub(' +', ' ', text)
 
 def set_from_sets(arr):
     return sorted(set().union(*arr))
 
-def eval_string_dec(console, text):
+def parse_units(text, precision=2):
+    # Plain decimal numbers only, for amounts that must never be evaluated
+    text = text.strip()
+    if not re.fullmatch(r'-?\d{1,15}(\.\d+)?', text) or decimal_places(text) > precision: return None
+    return to_units(Decimal(text), precision)
+
+def eval_string_units(console, text, precision=2):
     try:
         result = eval(text, {"__builtins__": {}}, {})
-        return dec(result)
+        return to_units(result, precision)
     except ZeroDivisionError:
         console.print(f"[error]Division by zero is not allowed[/]")
     except Exception as e:
         console.print(f"[error]<<ERROR> Error evaluating expression: {str(e)}[/]")
-
-def eval_string_float(console, text):
-    try:
-        return float(eval_string_dec(console, text))
-    except Exception as e:
-        console.print(f"[error]<<ERROR> Error converting expression to float: {str(e)}[/]")
@@ -1,27 +1,213 @@
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
 from beancount import loader
 from beancount.core.data import Transaction, Posting, Open
 from beancount.core.amount import Amount
-from beancount.parser import printer
+from beancount.core.display_context import Precision
+from beancount.core import flags
+from beancount.parser import parser, printer
 from datetime import datetime
-from .helpers import cur, dec, del_spaces, set_from_sets
+from .helpers import cur, to_units, from_units, precision_of, del_spaces, replace_lines, file_mtime
 from decimal import Decimal
 
+# Transactions made by beancount itself, their source line is a pad or other directive
+SYNTHETIC_FLAGS = (flags.FLAG_PADDING, flags.FLAG_SUMMARIZE, flags.FLAG_TRANSFER, flags.FLAG_CONVERSIONS)
+
 class Ledger:
     def __init__(self, entries, errors, options):
         self.title = options.get('title', 'Unknown')
         currency = options.get('operating_currency', [])
         self.currency = currency[0] if len(currency) else ''
-        self.transactions = [Bean(t) for t in entries if isinstance(t, Transaction)]
-        self.accounts = [o.account for o in entries if isinstance(o, Open)]
-        self.tags = set_from_sets([t.tags for t in entries if isinstance(t, Transaction)])
-        self.links = set_from_sets([t.links for t in entries if isinstance(t, Transaction)])
+        # Largest number of decimal places seen for each currency, including display_precision options
+        self.precisions = {}
+        dcontext = options.get('dcontext')
+        if dcontext:
+            for currency, ccontext in dcontext.ccontexts.items():
+                if currency == '__default__': continue
+                self.precisions[currency] = ccontext.get_fractional(Precision.MAXIMUM) or 0
+        self.precision = self.currency_precision(self.currency)
         self.errors = [str(err) for err in errors] if errors else []
-        self.payees = sorted(set([t.payee for t in entries if isinstance(t, Transaction) and t.payee]))
+        self.mtimes = {f: file_mtime(f) for f in options.get('include', [])}
+        # Edits kept in memory, entries are read back through it when set
+        self.patch = None
+
+        # Columnar projection of the transactions, entries are not kept and are parsed back from their file when needed
+        self.filenames = []
+        self.account_names = []
+        self.currencies = []
+        # Rec lines inserted since loading by file id, as the loaded line number they follow
+        self.shifts = {}
+
+        file_ids = {}
+        account_ids = {}
+        currency_ids = {}
+        scales = {}
+        entry_files = []
+        entry_linenos = []
+        entry_dates = []
+        post_starts = []
+        post_accounts = []
+        post_currencies = []
+        post_amounts = []
+        post_reconciled = []
+        accounts = []
+        tags = set()
+        links = set()
+        payees = set()
+        self.recs = set()
+        for entry in entries:
+            if isinstance(entry, Open):
+                accounts.append(entry.account)
+                continue
+            if not isinstance(entry, Transaction): continue
+            filename = entry.meta.get('filename')
+            # Only entries that can be read back from their own source line are projected
+            if entry.flag in SYNTHETIC_FLAGS or not filename or filename.startswith('<'): continue
+            if filename not in file_ids:
+                file_ids[filename] = len(self.filenames)
+                self.filenames.append(filename)
+            entry_files.append(file_ids[filename])
+            entry_linenos.append(entry.meta.get('lineno', 0))
+            entry_dates.append(entry.date.toordinal())
+            post_starts.append(len(post_amounts))
+            if entry.tags: tags.update(entry.tags)
+            if entry.links: links.update(entry.links)
+            if entry.payee: payees.add(entry.payee)
+            for post in entry.postings:
+                account_id = account_ids.get(post.account)
+                if account_id is None:
+                    account_id = account_ids[post.account] = len(self.account_names)
+                    self.account_names.append(post.account)
+                units = post.units
+                currency = units.currency if units is not None else ''
+                currency_id = currency_ids.get(currency)
+                if currency_id is None:
+                    currency_id = currency_ids[currency] = len(self.currencies)
+                    self.currencies.append(currency)
+                    scales[currency] = 10 ** self.currency_precision(currency)
+                meta = post.meta
+                if meta and 'rec' in meta:
+                    post_reconciled.append(len(post_amounts))
+                    self.recs.add(meta['rec'])
+                post_accounts.append(account_id)
+                post_currencies.append(currency_id)
+                # Ledger amounts never have more places than the currency's maximum precision, scaling is exact
+                post_amounts.append(int(units.number * scales[currency]) if units is not None and units.number is not None else 0)
+        post_starts.append(len(post_amounts))
+        self.entry_files = array('i', entry_files)
+        self.entry_linenos = array('i', entry_linenos)
+        self.entry_dates = array('i', entry_dates)
+        # One row per posting, post_starts[entry id] is the first row of an entry
+        self.post_starts = array('i', post_starts)
+        self.post_accounts = array('i', post_accounts)
+        self.post_currencies = array('i', post_currencies)
+        self.post_amounts = array('q', post_amounts)
+        # One flag per row, set once the posting has a rec
+        self.post_recs = bytearray(len(post_amounts))
+        for row in post_reconciled: self.post_recs[row] = 1
+        self.account_ids = account_ids
+        self.currency_ids = currency_ids
+        self.accounts = accounts
+        self.tags = sorted(tags)
+        self.links = sorted(links)
+        self.payees = sorted(payees)
+
+        # Posting rows sorted by (account, currency, absolute amount) packed into one integer for matching
+        keys = [self.index_key(a, c, u) for a, c, u in zip(post_accounts, post_currencies, post_amounts)]
+        self.post_index = array('i', sorted(range(len(keys)), key=keys.__getitem__))
+
+    def index_key(self, account_id, currency_id, amount):
+        return (((account_id << 16) | currency_id) << 64) | abs(amount)
+
+    def post_key(self, row):
+        return self.index_key(self.post_accounts[row], self.post_currencies[row], self.post_amounts[row])
+
+    def post_rows(self, account, currency, amount):
+        if account not in self.account_ids or currency not in self.currency_ids: return []
+        key = self.index_key(self.account_ids[account], self.currency_ids[currency], amount)
+        start = bisect_left(self.post_index, key, key=self.post_key)
+        end = bisect_right(self.post_index, key, lo=start, key=self.post_key)
+        return self.post_index[start:end]
+
+    def post_entry(self, row):
+        return bisect_right(self.post_starts, row) - 1
+
+    def lineno(self, file_id, lineno):
+        # Line numbers are kept as loaded, lines inserted since are added back in
+        shifts = self.shifts.get(file_id)
+        return lineno + bisect_right(shifts, lineno) if shifts else lineno
+
+    def read_lines(self, filename, lineno):
+        # Lines of a file from lineno on, through the patch if it holds the file
+        if self.patch is not None and filename in self.patch.files:
+            yield from islice(self.patch.lines(filename), lineno - 1, None)
+            return
+        with open(filename, 'r', encoding='utf-8') as file:
+            yield from islice(file, lineno - 1, None)
+
+    def bean(self, entry_id):
+        # Beans are only materialized for candidates that are shown or edited
+        file_id = self.entry_files[entry_id]
+        filename = self.filenames[file_id]
+        lineno = self.lineno(file_id, self.entry_linenos[entry_id])
+        lines = []
+        for line in self.read_lines(filename, lineno):
+            if lines and (not line.strip() or not line[0].isspace()): break
+            lines.append(line)
+        entries, errors, _ = parser.parse_string(''.join(lines))
+        if errors or len(entries) != 1 or not isinstance(entries[0], Transaction) or entries[0].date.toordinal() != self.entry_dates[entry_id]:
+            raise ValueError(f"Entry at {filename}:{lineno} changed since the ledger was loaded or was made by a plugin")
+        entry = entries[0]
+
+        # Parsed postings have no interpolated amounts, fill them in from the projection
+        amounts = {}
+        for row in range(self.post_starts[entry_id], self.post_starts[entry_id + 1]):
+            currency = self.currencies[self.post_currencies[row]]
+            amounts.setdefault(self.account_names[self.post_accounts[row]], Amount(from_units(self.post_amounts[row], self.currency_precision(currency)), currency))
+        postings = []
+        for post in entry.postings:
+            units = post.units if isinstance(post.units, Amount) and isinstance(post.units.number, Decimal) else amounts.get(post.account, post.units)
+            postings.append(post._replace(units=units, meta={**post.meta, 'filename': filename, 'lineno': lineno + post.meta['lineno'] - 1}))
+        entry = entry._replace(meta={**entry.meta, 'filename': filename, 'lineno': lineno}, postings=postings)
+        return Bean(entry, id=entry_id, precisions=self.precisions)
+
+    def set_rec(self, row, rec_id):
+        self.post_recs[row] = 1
+        self.recs.add(rec_id)
+
+    def currency_precision(self, currency):
+        return precision_of(self.precisions, currency)
+
+    def rescale(self, units, precision, currency):
+        # Convert units to the ledger's precision for the currency, None if they can not be represented exactly
+        ledger_precision = self.currency_precision(currency)
+        if precision < ledger_precision: return units * 10 ** (ledger_precision - precision)
+        scale = 10 ** (precision - ledger_precision)
+        return None if units % scale else units // scale
+
+    def changed(self):
+        return [f for f, mtime in self.mtimes.items() if file_mtime(f) != mtime]
+
+    def touch(self, filename):
+        if filename in self.mtimes: self.mtimes[filename] = file_mtime(filename)
+
+    def shift_lines(self, file_id, lineno):
+        # Record a line inserted after the current lineno of a file, kept as the loaded line number it follows
+        shifts = self.shifts.setdefault(file_id, [])
+        loaded = bisect_left(range(lineno - len(shifts), lineno + 1), lineno, key=lambda x: self.lineno(file_id, x)) + lineno - len(shifts)
+        insort(shifts, loaded + 1)
 
 class Bean:
-    def __init__(self, entry):
+    def __init__(self, entry, precision=None, id=None, precisions=None):
         self.entry = entry
-        self.amount = 0.0
+        self.precisions = precisions or {}
+        # Totals use the precision of the statement transaction, or the largest of the posting currencies
+        if precision is None:
+            precision = max([self.currency_precision(p.units.currency) for p in entry.postings if isinstance(p.units, Amount)] or [2])
+        self.precision = precision
+        self.id = id
+        self.amount = 0
         self.total()
 
     def __str__(self):
@@ -40,8 +226,8 @@ class Bean:
             narration = f'"{self.entry.narration}"'
         tags = self.print_tags()
         links = self.print_links()
-        if theme: return del_spaces(f'[date]{self.entry.date}[/] [flag]{self.entry.flag}[/] [string]{payee}[/] [string]{narration}[/] [file]{tags}[/] [file]{links}[/] [number]{cur(self.amount)}[/]'.strip())
-        else: return del_spaces(f'{self.entry.date} {self.entry.flag} {payee} {narration} {tags} {links} {cur(self.amount)}'.strip())
+        if theme: return del_spaces(f'[date]{self.entry.date}[/] [flag]{self.entry.flag}[/] [string]{payee}[/] [string]{narration}[/] [file]{tags}[/] [file]{links}[/] [number]{cur(self.amount, self.precision)}[/]'.strip())
+        else: return del_spaces(f'{self.entry.date} {self.entry.flag} {payee} {narration} {tags} {links} {cur(self.amount, self.precision)}'.strip())
 
     def print_tags(self):
         tags = ''
@@ -53,21 +239,26 @@ class Bean:
         for link in self.entry.links: links += f' ^{link}'
         return links
 
+    def currency_precision(self, currency):
+        return precision_of(self.precisions, currency)
+
     def total(self):
-        self.amount = 0.0
+        self.amount = 0
         for posting in self.entry.postings:
-            self.amount += float(posting.units.number) if posting.units and posting.units.number > 0 else 0.0
+            if isinstance(posting.units, Amount) and isinstance(posting.units.number, Decimal) and posting.units.number > 0: self.amount += to_units(posting.units.number, self.precision)
         # self.remaining = self.limit - self.amount
 
     def add_posting(self, posting):
         post_i = -1
-        post_amount = dec(posting['amount'])
+        # The posting amount is in units of its currency's precision
+        precision = self.currency_precision(posting['currency'])
+        post_amount = posting['amount']
         for i, post in enumerate(self.entry.postings):
             if post.account == posting['account']:
                 post_i = i
-                post_amount += post.units.number
+                post_amount += to_units(post.units.number, precision)
                 break
-        new_post = Posting(posting["account"], Amount(post_amount, posting["currency"]), None, None, None, {})
+        new_post = Posting(posting["account"], Amount(from_units(post_amount, precision), posting["currency"]), None, None, None, {})
         if post_i >= 0: self.entry.postings[post_i] = new_post
         else: self.entry.postings.append(new_post)
         self.total()
@@ -84,10 +275,12 @@ class Bean:
         self.entry = Transaction(meta, date, flag, payee, narration, tags, links, postings)
         self.total()
 
-def ledger_load(console, ledger_path):
+def ledger_load(console, ledger_path, patch=None):
     try:
         entries, errors, options = loader.load_file(ledger_path)
-        return Ledger(entries, errors, options)
+        ledger_data = Ledger(entries, errors, options)
+        ledger_data.patch = patch
+        return ledger_data
     except FileNotFoundError:
         console.print(f"[error]Error: File {ledger_path} not found[/]")
         return None
@@ -95,5 +288,35 @@ def ledger_load(console, ledger_path):
         console.print(f"[error]Error parsing Beancount file: {str(e)}[/]")
         return None
 
-def ledger_bean(txn, account_id, flag):
-    return Bean(Transaction({}, txn.date, flag, txn.payee, '', [], [], []))
+def ledger_bean(txn, account_id, flag, precisions=None):
+    # Amounts in the statement currency are never rounded below the statement's own precision
+    precisions = dict(precisions or {})
+    precisions[txn.currency] = max(precision_of(precisions, txn.currency), txn.precision)
+    return Bean(Transaction({}, txn.date, flag, txn.payee, '', [], [], []), txn.precision, precisions=precisions)
+
+def ledger_reconcile(console, ledger_data, bean, account, rec_id, patch=None):
+    # Add the rec metadata below the first unreconciled posting to account, leaving the rest of the entry as written
+    row = None
+    for r in range(ledger_data.post_starts[bean.id], ledger_data.post_starts[bean.id + 1]):
+        if ledger_data.account_names[ledger_data.post_accounts[r]] == account and not ledger_data.post_recs[r]:
+            row = r
+            break
+    post = next((p for p in bean.entry.postings if p.account == account and 'rec' not in p.meta), None)
+    if row is None or post is None:
+        console.print(f"[error]<<ERROR>> No unreconciled '{account}' posting in {bean.print_head()}[/]")
+        return False
+    file_id = ledger_data.entry_files[bean.id]
+    filename = ledger_data.filenames[file_id]
+    lineno = post.meta['lineno']
+    line = next(ledger_data.read_lines(filename, lineno), '').rstrip('\n')
+    if account not in line:
+        console.print(f"[error]<<ERROR>> Posting at {filename}:{lineno} changed since the ledger was loaded[/]")
+        return False
+    indent = line[:len(line) - len(line.lstrip())]
+    if not replace_lines(console, filename, f'{line}\n{indent}  rec: "{rec_id}"', lineno, 1, patch): return False
+    ledger_data.touch(filename)
+    ledger_data.set_rec(row, rec_id)
+    # Keep line numbers of following entries in the same file valid without reloading
+    ledger_data.shift_lines(file_id, lineno)
+    post.meta.update({'rec': rec_id})
+    return True
@@ -1,39 +1,44 @@
-from .helpers import cur, dec
+from .helpers import cur, to_units, decimal_places, precision_of
 from ofxparse import OfxParser
-from datetime import datetime
-from decimal import Decimal, ROUND_HALF_UP
+from datetime import date, datetime
 
 class Account:
-    def __init__(self, data):
+    def __init__(self, data, currency='', precisions=None):
         self.account_id = data.account.account_id
         self.account_type = data.account.account_type
         self.institution = data.account.institution.organization if data.account.institution else 'Unknown'
-        self.transactions = [Transaction(id=t.id, date=t.date, payee=t.payee, amount=t.amount) for t in data.account.statement.transactions]
+        self.currency = (data.account.statement.currency or currency).upper()
+        precision = precision_of(precisions, self.currency)
+        self.transactions = [Transaction(id=t.id, date=t.date, payee=t.payee, amount=t.amount, currency=self.currency, precision=precision) for t in data.account.statement.transactions]
 
 class Transaction:
-    def __init__(self, id="", date=datetime.today(), payee="", amount=0.0):
+    def __init__(self, id="", date=datetime.today(), payee="", amount=0, currency='', precision=2):
         self.id = id
         self.date = date.strftime('%Y-%m-%d')
         self.payee = payee
 
-        self.amount = float(amount)
+        # Amounts are kept as integer minor units, never less precise than the statement amount itself
+        self.currency = currency
+        self.precision = max(precision, decimal_places(amount))
+        self.amount = to_units(amount, self.precision)
         self.abs_amount = abs(self.amount)
         self.year = int(self.date.split('-')[0])
 
     def __str__(self):
-        return f'{self.date} {self.payee} {cur(self.amount)}'
+        return f'{self.date} {self.payee} {cur(self.amount, self.precision)}'
 
     def print(self, theme=False):
-        if theme: return f'[date]{self.date}[/] [string]{self.payee}[/] [number]{cur(self.amount)}[/]'
+        if theme: return f'[date]{self.date}[/] [string]{self.payee}[/] [number]{cur(self.amount, self.precision)}[/]'
         else: return self.__str__
 
-def ofx_load(console, ofx_path):
+def ofx_read(file, currency='', precisions=None):
+    return Account(OfxParser.parse(file), currency, precisions)
+
+def ofx_load(console, ofx_path, config=None, currency='', precisions=None):
     try:
         # Open and parse the OFX file
         with open(ofx_path, 'r') as file:
-            ofx = OfxParser.parse(file)
-
-        return Account(ofx)
+            return ofx_read(file, currency, precisions)
 
     except FileNotFoundError:
         console.print(f"[error]Error: File {ofx_path} not found.[/]")
@@ -42,23 +47,27 @@ def ofx_load(console, ofx_path):
         console.print(f"[error]Error parsing OFX file: {str(e)}[/]")
         return None
 
-def ofx_pending(txns, beans, acct):
-    pending = []
-    for txn in txns:
-        found = False
-        for bean in beans:
-            for post in bean.entry.postings:
-                if 'rec' in post.meta and post.meta['rec'] == txn.id:
-                    found = True
-                    break
-        if not found:
-            pending.append(txn)
-    return pending
+def ofx_pending(txns, recs, acct):
+    return [txn for txn in txns if txn.id not in recs]
 
-def ofx_matches(txn, beans, acct):
+def ofx_matches(txn, ledger_data, acct, days=None):
     matches = []
-    for bean in beans:
-        for post in bean.entry.postings:
-            if post.account == acct and 'rec' not in post.meta and abs(post.units.number) == dec(txn.abs_amount):
-                matches.append(bean)
+    amount = ledger_data.rescale(txn.abs_amount, txn.precision, txn.currency)
+    if amount is None: return matches
+    txn_date = date.fromisoformat(txn.date).toordinal()
+    entry_ids = []
+    for row in ledger_data.post_rows(acct, txn.currency, amount):
+        entry_id = ledger_data.post_entry(row)
+        if days is not None and abs(ledger_data.entry_dates[entry_id] - txn_date) > days: continue
+        if not ledger_data.post_recs[row] and entry_id not in entry_ids: entry_ids.append(entry_id)
+    for entry_id in entry_ids:
+        # Skip candidates that can not be read back from the ledger files, like plugin made entries
+        try:
+            matches.append(ledger_data.bean(entry_id))
+        except (ValueError, OSError):
+            continue
     return matches
+
+def ofx_rank(txn, matches):
+    txn_date = date.fromisoformat(txn.date)
+    return sorted(matches, key=lambda bean: abs((bean.entry.date - txn_date).days))
@@ -0,0 +1,405 @@
+import json, os, re, tempfile, threading, typer, uuid
+from .bean_import import account_callback, flag_callback, period_callback
+from .helpers import get_key, set_key, append_lines, parse_units, cur
+from .ledger import ledger_load, ledger_bean, ledger_reconcile
+from .ofx import ofx_pending, ofx_matches, ofx_rank
+from .prompts import is_account
+from .statement import SOURCES, statement_load, statement_config
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from rich.console import Console
+from rich.theme import Theme
+from typing_extensions import Annotated
+from urllib.parse import urlparse, parse_qs
+
+class RequestError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class RWLock:
+    # Many readers or a single writer, waiting writers go first so a stream of reads can not starve them
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self.condition:
+            self.condition.wait_for(lambda: not self.writer and not self.writers_waiting)
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.readers -= 1
+                if not self.readers: self.condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self.condition:
+            self.writers_waiting += 1
+            self.condition.wait_for(lambda: not self.writer and not self.readers)
+            self.writers_waiting -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.writer = False
+                self.condition.notify_all()
+
+class Session:
+    def __init__(self, ofx_data, account, period):
+        self.id = uuid.uuid4().hex
+        self.ofx_data = ofx_data
+        self.account = account
+        self.period = period
+        self.pending = {}
+        self.reconciled = []
+        self.inserted = []
+        self.skipped = []
+
+    def txn(self, txn_id):
+        if txn_id not in self.pending: raise RequestError(f"Transaction '{txn_id}' is not pending", 404)
+        return self.pending[txn_id]
+
+    def summary(self):
+        return {
+            "session": self.id,
+            "account": self.account,
+            "account_id": self.ofx_data.account_id,
+            "institution": self.ofx_data.institution,
+            "period": self.period,
+            "pending": len(self.pending),
+            "reconciled": len(self.reconciled),
+            "inserted": len(self.inserted),
+            "skipped": len(self.skipped)
+        }
+
+class State:
+    def __init__(self, console, ledger, ledger_data, payees, output, flag, banks=None):
+        self.console = console
+        self.ledger = ledger
+        self.ledger_data = ledger_data
+        # Bumped on every reload, match keys from an older ledger are refused
+        self.generation = 0
+        self.payees = payees
+        self.output = output
+        self.flag = flag
+        self.banks = banks
+        self.sessions = {}
+        # Matching only reads the loaded ledger and shares the lock, reloads and anything that writes hold it alone
+        self.lock = RWLock()
+
+    def session(self, session_id):
+        if session_id not in self.sessions: raise RequestError(f"Session '{session_id}' not found", 404)
+        return self.sessions[session_id]
+
+    def refresh(self):
+        # Reload the ledger when an included file changed outside of the server, True if it was reloaded
+        changed = self.ledger_data.changed()
+        if not changed: return False
+        self.console.print(f"Reloading LEDGER, changed: {', '.join(f'[file]{f}[/]' for f in changed)}")
+        ledger_data = ledger_load(self.console, self.ledger)
+        if not ledger_data: raise RequestError("Error reloading LEDGER file", 500)
+        self.ledger_data = ledger_data
+        self.generation += 1
+        return True
+
+    def current(self):
+        # Check for changes under the shared lock, only a reload needs the ledger to itself
+        with self.lock.read():
+            changed = self.ledger_data.changed()
+        if changed:
+            with self.lock.write(): self.refresh()
+
+    def pending(self, txn):
+        if txn.id in self.ledger_data.recs: raise RequestError(f"Transaction '{txn.id}' is already reconciled in the LEDGER", 409)
+
+    def upload(self, body, account, period, format='ofx', bank=''):
+        suffix = f".{format.lower()}"
+        if suffix not in SOURCES: raise RequestError(f"Unsupported statement format '{format}', use one of {', '.join(s[1:] for s in SOURCES)}")
+        if suffix == '.csv' and not bank: raise RequestError("Please specify the ?bank= configuration for csv statements")
+        # Loaders report errors to a console, keep them for the response
+        errors = Console(file=StringIO(), width=1000)
+        config = statement_config(errors, self.banks, bank) if self.banks else None
+        if bank and config is None: raise RequestError(errors.file.getvalue().strip() or f"Bank '{bank}' not found, start the server with --banks")
+
+        # Parse outside of the lock through the same loaders as the CLI, from a temporary file with the format's suffix
+        self.current()
+        with self.lock.read():
+            currency, precisions = self.ledger_data.currency, self.ledger_data.precisions
+        fd, statement_path = tempfile.mkstemp(prefix='bean-import-', suffix=suffix)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(body)
+            statement = statement_load(errors, statement_path, config, currency, precisions)
+            if not statement: raise RequestError(errors.file.getvalue().strip() or "Error parsing statement file")
+            filtered = [t for t in statement.transactions if t.date.startswith(period)]
+        except RequestError:
+            raise
+        except Exception as e:
+            raise RequestError(f"Error parsing statement file: {str(e)}")
+        finally:
+            os.remove(statement_path)
+
+        session = Session(statement, account, period)
+        with self.lock.write():
+            for txn in ofx_pending(filtered, self.ledger_data.recs, account):
+                session.pending[txn.id] = txn
+            self.sessions[session.id] = session
+        self.console.print(f"Session [answer]{session.id}[/]: [number]{len(session.pending)}[/] pending for [answer]{account}[/]")
+        return session.summary()
+
+    def matches(self, session, txn):
+        self.current()
+        with self.lock.read():
+            return [(f"{self.generation}:{bean.id}", bean) for bean in ofx_rank(txn, ofx_matches(txn, self.ledger_data, session.account))]
+
+    def reconcile(self, session, txn_id, match):
+        if not isinstance(match, str) or not re.fullmatch(r'\d+:\d+', match):
+            raise RequestError(f"Invalid match '{match}' for transaction '{txn_id}', use a 'match' key from the matches")
+        generation, entry_id = (int(m) for m in match.split(':'))
+        with self.lock.write():
+            txn = session.txn(txn_id)
+            # Line numbers are only valid for the ledger the match was taken from
+            if self.refresh() or generation != self.generation:
+                raise RequestError("The LEDGER changed since the matches were fetched, fetch them again", 409)
+            self.pending(txn)
+            bean = next((b for b in ofx_matches(txn, self.ledger_data, session.account) if b.id == entry_id), None)
+            if bean is None: raise RequestError(f"Match '{match}' is no longer available for transaction '{txn_id}'", 409)
+            if not ledger_reconcile(self.console, self.ledger_data, bean, session.account, txn.id):
+                raise RequestError(f"Error reconciling transaction '{txn_id}'", 500)
+            del session.pending[txn.id]
+            session.reconciled.append(txn.id)
+        self.console.print(f"Reconciled [answer]{txn.id}[/] with {bean.print_head(theme=True)}")
+        return {"id": txn.id, "entry": bean.print()}
+
+    def insert(self, session, txn_id, data):
+        if not self.output: raise RequestError("Inserting needs the server to be started with an --output file")
+        postings = data.get('postings', [])
+        if not isinstance(postings, list) or not len(postings): raise RequestError("Please provide a list of postings")
+        for key in ('tags', 'links'):
+            if not isinstance(data.get(key, []), list) or not all(isinstance(v, str) for v in data.get(key, [])):
+                raise RequestError(f"'{key}' must be a list of strings")
+        try:
+            flag = flag_callback(data.get('flag', self.flag))
+        except typer.BadParameter as e:
+            raise RequestError(str(e))
+        with self.lock.write():
+            txn = session.txn(txn_id)
+            self.refresh()
+            self.pending(txn)
+            new_bean = ledger_bean(txn, session.ofx_data.account_id, flag, self.ledger_data.precisions)
+
+            # Validate every posting before anything is written
+            totals = {}
+            for posting in postings:
+                if not isinstance(posting, dict) or not isinstance(posting.get('account'), str) or not is_account(posting['account']):
+                    raise RequestError(f"Invalid posting {json.dumps(posting)}")
+                currency = str(posting.get('currency') or txn.currency or self.ledger_data.currency)
+                # Amounts from the network are parsed as plain decimals, never evaluated
+                precision = new_bean.currency_precision(currency)
+                amount = posting.get('amount')
+                amount = parse_units(str(amount), precision) if isinstance(amount, (str, int, float)) and not isinstance(amount, bool) else None
+                if amount is None: raise RequestError(f"Invalid posting amount {json.dumps(posting)}, use a plain decimal number with at most {precision} places")
+                totals[currency] = totals.get(currency, 0) + amount
+                new_bean.add_posting({
+                    "account": posting['account'],
+                    "amount": amount,
+                    "currency": currency})
+            residual = [f"{cur(total, new_bean.currency_precision(c))} {c}" for c, total in totals.items() if total]
+            if residual: raise RequestError(f"Postings do not balance, residual {', '.join(residual)}")
+            post = next((p for p in new_bean.entry.postings if p.account == session.account), None)
+            if post is None and not data.get('force'):
+                raise RequestError(f"No posting to the session account '{session.account}', send 'force' to insert without a rec")
+            if post is not None: post.meta.update({'rec': txn.id})
+
+            payee = data.get('payee')
+            new_bean.update(
+                payee=payee or get_key(self.payees, txn.payee) or txn.payee,
+                narration=str(data.get('narration', '')),
+                tags=set(data.get('tags', [])),
+                links=set(data.get('links', [])))
+            if not append_lines(self.console, self.output, new_bean.print()):
+                raise RequestError(f"Error inserting transaction '{txn_id}'", 500)
+            self.ledger_data.touch(str(Path(self.output).resolve()))
+            if post is not None: self.ledger_data.recs.add(txn.id)
+            if payee: set_key(self.payees, txn.payee, payee)
+            del session.pending[txn.id]
+            session.inserted.append(txn.id)
+        self.console.print(f"Inserted {new_bean.print_head(theme=True)}")
+        return {"id": txn.id, "entry": new_bean.print()}
+
+    def skip(self, session, txn_id):
+        with self.lock.write():
+            txn = session.txn(txn_id)
+            del session.pending[txn.id]
+            session.skipped.append(txn.id)
+        return {"id": txn.id}
+
+def txn_json(txn):
+    return {"id": txn.id, "date": txn.date, "payee": txn.payee, "amount": cur(txn.amount, txn.precision)}
+
+def bean_json(key, bean, account):
+    post_match = None
+    for post in bean.entry.postings:
+        if post.account == account:
+            post_match = post
+            break
+    return {
+        "match": key,
+        "head": bean.print_head(),
+        "filename": bean.entry.meta['filename'],
+        "lineno": bean.entry.meta['lineno'],
+        "account": post_match.account if post_match else account,
+        "amount": f'{post_match.units.number:f}' if post_match else cur(bean.amount, bean.precision)
+    }
+
+class Handler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, format, *args):
+        self.state.console.print(f"{self.address_string()} {format % args}", style="file", markup=False, soft_wrap=True)
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length) if length else b''
+
+    def read_json(self):
+        try:
+            data = json.loads(self.read_body() or b'{}')
+        except json.JSONDecodeError as e:
+            raise RequestError(f"Invalid JSON body: {str(e)}")
+        if not isinstance(data, dict): raise RequestError("JSON body must be an object")
+        if 'id' not in data: raise RequestError("Missing transaction 'id'")
+        return data
+
+    def route(self, method):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        parts = [p for p in url.path.split('/') if p]
+        state = self.state
+
+        if method == 'GET' and parts == ['ledger']:
+            ledger_data = state.ledger_data
+            return {
+                "title": ledger_data.title,
+                "currency": ledger_data.currency,
+                "transactions": len(ledger_data.entry_files),
+                "accounts": ledger_data.accounts,
+                "payees": ledger_data.payees,
+                "tags": ledger_data.tags,
+                "links": ledger_data.links,
+                "errors": ledger_data.errors
+            }
+
+        if method == 'POST' and parts in (['statement'], ['ofx']):
+            account = query.get('account', '')
+            period = query.get('period', '')
+            try:
+                account_callback(account)
+                period_callback(period)
+            except typer.BadParameter as e:
+                raise RequestError(str(e))
+            if not account: raise RequestError("Please specify the ?account= the statement file belongs to")
+            return state.upload(self.read_body(), account, period, query.get('format', 'ofx'), query.get('bank', ''))
+
+        if len(parts) < 2 or parts[0] != 'sessions': raise RequestError("Not found", 404)
+        session = state.session(parts[1])
+        action = parts[2] if len(parts) > 2 else ''
+
+        if method == 'GET' and action == '':
+            return session.summary()
+        if method == 'GET' and action == 'pending':
+            return [txn_json(t) for t in list(session.pending.values())]
+        if method == 'GET' and action == 'matches':
+            txn = session.txn(query.get('id', ''))
+            return [bean_json(key, m, session.account) for key, m in state.matches(session, txn)]
+        if method == 'POST' and action == 'reconcile':
+            data = self.read_json()
+            return state.reconcile(session, data['id'], data.get('match'))
+        if method == 'POST' and action == 'insert':
+            data = self.read_json()
+            return state.insert(session, data['id'], data)
+        if method == 'POST' and action == 'skip':
+            return state.skip(session, self.read_json()['id'])
+        raise RequestError("Not found", 404)
+
+    def handle_method(self, method):
+        try:
+            self.send_json(self.route(method))
+        except RequestError as e:
+            self.send_json({"error": str(e)}, e.status)
+        except Exception as e:
+            self.state.console.print(f"[error]<<ERROR>> {str(e)}[/]")
+            self.send_json({"error": str(e)}, 500)
+
+    def do_GET(self):
+        self.handle_method('GET')
+
+    def do_POST(self):
+        self.handle_method('POST')
+
+def serve(
+    ledger: Annotated[Path, typer.Argument(help="The beancount ledger file to base the parser from", exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True)],
+    output: Annotated[Path, typer.Option("--output", "-o", help="The output file to append inserted transactions to", show_default=False, exists=False)]=None,
+    payees: Annotated[Path, typer.Option("--payees", "-p", help="The payee file to use for name substitutions", exists=False)]="payees.json",
+    flag: Annotated[str, typer.Option("--flag", "-f", help="Specify the default flag to set for transactions", callback=flag_callback)]="*",
+    banks: Annotated[Path, typer.Option("--banks", "-k", help="The json file with csv bank configurations, chosen per upload with ?bank=", exists=False)]="banks.json",
+    host: Annotated[str, typer.Option("--host", "-H", help="The address to listen on")]="127.0.0.1",
+    port: Annotated[int, typer.Option("--port", "-P", help="The port to listen on")]=8765
+):
+    """
+    Serve a local HTTP/JSON API to reconcile ofx/qfx/csv statement files against a beancount LEDGER
+
+    The LEDGER is loaded once and shared between requests.
+    Optionally specify an --output file to append inserted transactions to, inserting is disabled without one.
+    Optionally specify a --payees json file to use for payee name substitutions.
+    Optionally set the default --flag to set for transactions. [*/!]
+    Optionally specify a --banks json file with csv bank configurations, required for csv uploads.
+    Optionally set the --host and --port to listen on.
+    """
+
+    theme = Theme({
+        "number": "cyan",
+        "date": "orange4",
+        "flag": "magenta",
+        "error": "red",
+        "file": "grey50",
+        "string": "green",
+        "warning": "yellow",
+        "answer": "blue"
+    })
+    console = Console(theme=theme, stderr=True)
+
+    ledger_data = ledger_load(console, ledger)
+    if ledger_data and len(ledger_data.entry_files):
+        console.print(f"Parsed [number]{len(ledger_data.entry_files)}[/] beans from LEDGER file [file]{ledger}[/]")
+    else:
+        console.print(f"[warning]No transaction entries found in LEDGER file. Exiting.[/]")
+        raise typer.Exit()
+
+    Handler.state = State(console, ledger, ledger_data, payees, output, flag, banks)
+    server = ThreadingHTTPServer((host, port), Handler)
+    console.print(f"Serving on [answer]http://{host}:{port}[/] (Ctrl-C to quit)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    console.print(f"[warning]Server stopped. Exiting[/]")
@@ -0,0 +1,127 @@
+import csv, hashlib, re
+from decimal import Decimal
+from .helpers import get_json, precision_of
+from .ofx import Transaction, ofx_load
+from datetime import datetime
+from pathlib import Path
+
+class CsvStatement:
+    def __init__(self, csv_path, config, currency='', precisions=None):
+        self.path = csv_path
+        self.config = config
+        self.currency = config.get('currency', currency)
+        self.precision = precision_of(precisions, self.currency)
+        self.account_id = config['account_id']
+        self.account_type = config.get('account_type', 'CSV')
+        self.institution = config.get('institution', 'Unknown')
+
+    @property
+    def transactions(self):
+        # Re-read the file on every iteration instead of holding the rows in memory
+        return csv_transactions(self.path, self.config, self.account_id, self.currency, self.precision)
+
+def csv_amount(text, decimal='.'):
+    text = text.strip()
+    negative = text.startswith('(') and text.endswith(')')
+    text = re.sub(r'[^0-9\-' + re.escape(decimal) + ']', '', text).replace(decimal, '.')
+    if not text: return Decimal(0)
+    amount = Decimal(text)
+    return -amount if negative else amount
+
+def csv_column(row, column):
+    return row[column] if column < len(row) else ''
+
+def csv_reader(file, config):
+    # Map the configured columns to row indexes, names are looked up in the header row
+    for _ in range(config.get('skip', 0)): next(file, None)
+    reader = csv.reader(file, delimiter=config.get('delimiter', ','))
+    names = {}
+    if config.get('header', True):
+        names = {name.strip(): i for i, name in enumerate(next(reader, []))}
+    columns = {}
+    for key, column in config['columns'].items():
+        if isinstance(column, int): columns[key] = column
+        elif column in names: columns[key] = names[column]
+        elif names: raise ValueError(f"CSV column '{column}' not found in the header row")
+        else: raise ValueError(f"CSV column '{column}' is a name but 'header' is off, use a column index")
+    return reader, columns
+
+def csv_transactions(csv_path, config, account_id, currency='', precision=2):
+    date_format = config.get('date_format', '%Y-%m-%d')
+    decimal = config.get('decimal', '.')
+    sign = -1 if config.get('sign', 'normal') == 'inverted' else 1
+    seen = {}
+    with open(csv_path, 'r', encoding=config.get('encoding', 'utf-8-sig'), newline='') as file:
+        reader, columns = csv_reader(file, config)
+        for row in reader:
+            date = csv_column(row, columns['date']).strip()
+            if not date: continue
+            date = datetime.strptime(date, date_format)
+            payee = csv_column(row, columns['payee']).strip()
+            if 'amount' in columns:
+                amount = csv_amount(csv_column(row, columns['amount']), decimal)
+            else:
+                amount = csv_amount(csv_column(row, columns['credit']), decimal) - abs(csv_amount(csv_column(row, columns['debit']), decimal))
+            amount *= sign
+            txn = Transaction(date=date, payee=payee, amount=amount, currency=currency, precision=precision)
+
+            # Use the bank's id if available, else synthesize a stable FITID from the row,
+            # hashing the amount as written so it does not depend on the ledger's precision
+            txn.id = csv_column(row, columns['id']).strip() if 'id' in columns else ''
+            if not txn.id:
+                key = hashlib.sha1(f"{account_id}|{txn.date}|{payee}|{amount.normalize():f}".encode('utf-8')).digest()
+                seen[key] = seen.get(key, -1) + 1
+                txn.id = hashlib.sha1(key + str(seen[key]).encode('utf-8')).hexdigest()[:16]
+
+            yield txn
+
+def csv_load(console, csv_path, config=None, currency='', precisions=None):
+    if not config or 'columns' not in config:
+        console.print(f"[error]Error: No --bank configuration with 'columns' given for CSV file {csv_path}[/]")
+        return None
+    columns = config['columns']
+    if not all(c in columns for c in ('date', 'payee')) or not ('amount' in columns or ('debit' in columns and 'credit' in columns)):
+        console.print(f"[error]Error: CSV columns must map 'date', 'payee' and either 'amount' or 'debit' and 'credit'[/]")
+        return None
+    if not config.get('account_id'):
+        console.print(f"[error]Error: CSV bank configuration needs an 'account_id' to keep generated ids stable across exports[/]")
+        return None
+    if not Path(csv_path).exists():
+        console.print(f"[error]Error: File {csv_path} not found.[/]")
+        return None
+    # Check the columns against the header once, transactions are read lazily
+    with open(csv_path, 'r', encoding=config.get('encoding', 'utf-8-sig'), newline='') as file:
+        try:
+            csv_reader(file, config)
+        except ValueError as e:
+            console.print(f"[error]Error: {str(e)}[/]")
+            return None
+    return CsvStatement(csv_path, config, currency, precisions)
+
+SOURCES = {
+    '.ofx': ofx_load,
+    '.qfx': ofx_load,
+    '.csv': csv_load
+}
+
+def statement_config(console, config_path, bank):
+    if not bank: return None
+    if not Path(config_path).exists():
+        console.print(f"[error]Error: File {config_path} not found.[/]")
+        return None
+    banks = get_json(config_path)
+    if bank not in banks:
+        console.print(f"[error]Error: Bank '{bank}' not found in {config_path}[/]")
+        return None
+    return banks[bank]
+
+def statement_load(console, statement_path, config=None, currency='', precisions=None):
+    suffix = Path(statement_path).suffix.lower()
+    if suffix not in SOURCES:
+        console.print(f"[error]Error: Unsupported statement file type '{suffix}'[/]")
+        return None
+    try:
+        return SOURCES[suffix](console, statement_path, config, currency, precisions)
+    except Exception as e:
+        console.print(f"[error]Error parsing statement file: {str(e)}[/]")
+        return None
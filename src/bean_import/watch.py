@@ -0,0 +1,160 @@
+import time, typer
+from .bean_import import account_callback
+from .helpers import get_json, set_json, cur, Patch
+from .ledger import ledger_load, ledger_reconcile
+from .ofx import ofx_pending, ofx_matches, ofx_rank
+from .statement import SOURCES, statement_load, statement_config
+from pathlib import Path
+from rich.console import Console
+from rich.theme import Theme
+from typing_extensions import Annotated
+
+class Watcher:
+    def __init__(self, folder, debounce):
+        self.folder = folder
+        self.debounce = debounce
+        self.seen = {}
+        self.waiting = {}
+
+    def ready(self):
+        # A file is ready once its size and mtime have not changed for the debounce period
+        now = time.monotonic()
+        ready = []
+        for path in sorted(self.folder.iterdir()):
+            if not path.is_file() or path.suffix.lower() not in SOURCES: continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            sig = (stat.st_size, stat.st_mtime_ns)
+            if self.seen.get(path) == sig: continue
+            if path not in self.waiting or self.waiting[path][0] != sig:
+                self.waiting[path] = (sig, now)
+                if self.debounce > 0: continue
+            if now - self.waiting[path][1] >= self.debounce:
+                del self.waiting[path]
+                self.seen[path] = sig
+                ready.append(path)
+        return ready
+
+def watch_file(console, err_console, ofx_path, ledger_data, account, review, days, config=None, patch=None):
+    ofx_data = statement_load(err_console, ofx_path, config, ledger_data.currency, ledger_data.precisions)
+    if not ofx_data: return 0, 0
+    try:
+        pending = ofx_pending(ofx_data.transactions, ledger_data.recs, account)
+    except Exception as e:
+        err_console.print(f"[error]Error parsing statement file: {str(e)}[/]")
+        return 0, 0
+    # Read the review queue once per file, entries reconciled since they were queued are dropped when it is written
+    queue = get_json(review, patch)
+    queued = dict(queue)
+    reconcile_count = 0
+    review_count = 0
+    for txn in pending:
+        # Only candidates dated within days of the statement transaction, closest first
+        matches = ofx_rank(txn, ofx_matches(txn, ledger_data, account, days))
+
+        # Unambiguous, reconcile
+        if len(matches) == 1 and ledger_reconcile(err_console, ledger_data, matches[0], account, txn.id, patch):
+            console.print(f"...Reconciled {txn.print(theme=True)} with {matches[0].print_head(theme=True)}")
+            reconcile_count += 1
+            continue
+
+        # Queue for review
+        queued[txn.id] = {
+            "file": str(ofx_path),
+            "account": account,
+            "date": txn.date,
+            "payee": txn.payee,
+            "amount": cur(txn.amount, txn.precision),
+            "matches": len(matches)
+        }
+        console.print(f"...Queued {txn.print(theme=True)} for review ([number]{len(matches)}[/] matches)")
+        review_count += 1
+    queued = {k: v for k, v in queued.items() if k not in ledger_data.recs}
+    if queued != queue: set_json(queued, review, patch)
+    return reconcile_count, review_count
+
+def watch(
+    folder: Annotated[Path, typer.Argument(help="The folder to watch for ofx/qfx/csv statement files", exists=True, file_okay=False, dir_okay=True, readable=True, resolve_path=True)],
+    ledger: Annotated[Path, typer.Argument(help="The beancount ledger file to base the parser from", exists=True, file_okay=True, dir_okay=False, readable=True, resolve_path=True)],
+    account: Annotated[str, typer.Option("--account", "-a", help="Specify the account the statement files belong to", callback=account_callback)]="",
+    review: Annotated[Path, typer.Option("--review", "-r", help="The json file to queue transactions needing review into", exists=False)]="review.json",
+    days: Annotated[int, typer.Option("--days", "-D", help="Only reconcile with entries dated within this many days of the statement transaction", min=0)]=7,
+    interval: Annotated[float, typer.Option("--interval", "-i", help="Seconds between folder scans")]=2.0,
+    debounce: Annotated[float, typer.Option("--debounce", "-w", help="Seconds a file must stay unchanged before it is parsed")]=5.0,
+    once: Annotated[bool, typer.Option("--once", help="Parse the files currently in the folder and exit")]=False,
+    bank: Annotated[str, typer.Option("--bank", "-b", help="The bank configuration to use for csv statements")]="",
+    banks: Annotated[Path, typer.Option("--banks", "-k", help="The json file with csv bank configurations", exists=False)]="banks.json",
+    dry_run: Annotated[bool, typer.Option("--dry-run", "-n", help="Print a unified diff of all ledger and review changes when finished instead of writing them")]=False,
+    patch: Annotated[Path, typer.Option("--patch", "-x", help="Write a unified diff of all ledger and review changes to a file when finished instead of writing them", show_default=False, exists=False)]=None
+):
+    """
+    Watch a FOLDER for ofx/qfx/csv statement files and reconcile them against a beancount LEDGER
+
+    Transactions with a single match within --days of the statement date are reconciled, the rest are queued for review.
+    The --account the statement files belong to is required.
+    Optionally specify a --review json file to queue transactions into.
+    Optionally set the scan --interval and --debounce in seconds.
+    Optionally parse the current files --once and exit.
+    Optionally specify the --bank configuration from a --banks json file, required for csv statements.
+    Optionally print changes as a diff with --dry-run or write them to a --patch file when finished.
+    """
+
+    theme = Theme({
+        "number": "cyan",
+        "date": "orange4",
+        "flag": "magenta",
+        "error": "red",
+        "file": "grey50",
+        "string": "green",
+        "warning": "yellow",
+        "answer": "blue"
+    })
+    console = Console(theme=theme)
+    err_console = Console(theme=theme, stderr=True)
+
+    if not account: raise typer.BadParameter("Please specify the account the statement files belong to", param_hint="'--account'")
+    console.print(f"WATCH Folder: [file]{folder}[/]\nLEDGER File: [file]{ledger}[/]\nREVIEW File: [file]{review}[/]")
+    console.print(f"STATEMENT files using account: [answer]{account}[/], matching within [number]{days}[/] days")
+    config = statement_config(err_console, banks, bank)
+    file_patch = Patch() if dry_run or patch else None
+
+    ledger_data = ledger_load(err_console, ledger, file_patch)
+    if not ledger_data:
+        raise typer.Exit()
+    console.print(f"Parsed [number]{len(ledger_data.entry_files)}[/] beans from LEDGER file")
+
+    watcher = Watcher(folder, 0 if once else debounce)
+    stop = False
+    try:
+        while True:
+            for ofx_path in watcher.ready():
+                # Keep the ledger warm, reload only when an included file changed outside of the watcher
+                changed = ledger_data.changed()
+                if changed and file_patch is not None and file_patch.files:
+                    err_console.print(f"[error]LEDGER changed outside of the watcher while changes are kept in memory: {', '.join(f'[file]{f}[/]' for f in changed)}. Stopping[/]")
+                    stop = True
+                    break
+                if changed:
+                    console.print(f"Reloading LEDGER, changed: {', '.join(f'[file]{f}[/]' for f in changed)}")
+                    new_ledger_data = ledger_load(err_console, ledger, file_patch)
+                    if new_ledger_data: ledger_data = new_ledger_data
+                console.print(f"Parsing [file]{ofx_path}[/]")
+                reconcile_count, review_count = watch_file(console, err_console, ofx_path, ledger_data, account, review, days, config, file_patch)
+                console.print(f"[string]Reconciled [number]{reconcile_count}[/], queued [number]{review_count}[/] for review[/]")
+            if once or stop: break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+    # Show or save changes kept in memory
+    if file_patch is not None:
+        diff = file_patch.diff(ledger.parent)
+        if dry_run:
+            console.print(diff, markup=False, highlight=False, soft_wrap=True, end='')
+        if patch:
+            with open(patch, 'w', encoding='utf-8', newline='\n') as file:
+                file.write(diff)
+            console.print(f"Wrote changes to [file]{patch}[/]")
+    console.print(f"[warning]Finished watching. Exiting[/]")
@@ -0,0 +1,93 @@
+from decimal import Decimal
+from beancount import loader
+from bean_import.helpers import to_units, from_units, cur, decimal_places, precision_of, parse_units
+from bean_import.ledger import Ledger
+
+def test_to_units():
+    assert to_units(Decimal('10.49')) == 1049
+    assert to_units(Decimal('-10.50')) == -1050
+    assert to_units('0.00012345', 8) == 12345
+    assert to_units(10.005, 2) == 1001
+    assert to_units(Decimal('10.49'), 0) == 10
+
+def test_from_units():
+    assert from_units(1049) == Decimal('10.49')
+    assert from_units(-1050) == Decimal('-10.50')
+    assert from_units(12345, 8) == Decimal('0.00012345')
+
+def test_cur():
+    assert cur(1049) == '10.49'
+    assert cur(-5) == '-0.05'
+    assert cur(100, 0) == '100'
+    assert cur(12345, 8) == '0.00012345'
+    # Small and zero amounts stay in plain notation
+    assert cur(5, 8) == '0.00000005'
+    assert cur(0, 8) == '0.00000000'
+    assert cur(-1, 8) == '-0.00000001'
+
+def test_parse_units():
+    assert parse_units('30') == 3000
+    assert parse_units(' -30.5 ') == -3050
+    assert parse_units('0.00000001', 8) == 1
+    # Too many places, exponents, expressions and oversized numbers are refused, never evaluated
+    assert parse_units('30.555') is None
+    for text in ['1e5', '9**9**9**9', '().__class__', '1+1', '1234567890123456', '', 'NaN']:
+        assert parse_units(text) is None
+
+def test_decimal_places():
+    assert decimal_places(Decimal('10')) == 0
+    assert decimal_places(Decimal('10.5')) == 1
+    assert decimal_places('0.00012345') == 8
+    assert decimal_places(Decimal('1E+2')) == 0
+
+def test_precision_of():
+    assert precision_of(None, 'USD') == 2
+    assert precision_of({'USD': 0}, 'USD') == 0
+    assert precision_of({'USD': 0}, 'BTC') == 2
+
+def ledger(text, tmp_path):
+    # Entries are projected only when they can be read back from a file
+    path = tmp_path / 'main.bean'
+    path.write_text(text)
+    entries, errors, options = loader.load_file(str(path))
+    return Ledger(entries, errors, options)
+
+LEDGER = """
+option "operating_currency" "USD"
+2024-01-01 open Assets:Bank
+2024-01-01 open Assets:Crypto
+2024-01-01 open Expenses:Food
+2024-01-02 * "A"
+  Assets:Bank -10 USD
+  Expenses:Food
+2024-01-03 * "B"
+  Assets:Bank -20 USD
+  Expenses:Food
+2024-01-04 * "C"
+  Assets:Bank -10.50 USD
+  Expenses:Food
+2024-01-05 * "D"
+  Assets:Crypto 0.00012345 BTC
+  Assets:Bank -5 USD
+"""
+
+def test_precision_inference_uses_maximum(tmp_path):
+    data = ledger(LEDGER, tmp_path)
+    assert data.precisions['USD'] == 2
+    assert data.precisions['BTC'] == 8
+    assert data.precision == 2
+    # Mostly whole amounts must not round the others away
+    assert len(data.post_rows('Assets:Bank', 'USD', 1050)) == 1
+    assert len(data.post_rows('Assets:Crypto', 'BTC', 12345)) == 1
+    assert len(data.post_rows('Assets:Bank', 'USD', 10)) == 0
+
+def test_precision_display_option(tmp_path):
+    data = ledger('option "display_precision" "CAD:0.001"\n' + LEDGER, tmp_path)
+    assert data.precisions['CAD'] == 3
+
+def test_rescale(tmp_path):
+    data = ledger(LEDGER, tmp_path)
+    assert data.rescale(105, 1, 'USD') == 1050
+    assert data.rescale(1050, 2, 'USD') == 1050
+    assert data.rescale(10500, 3, 'USD') == 1050
+    assert data.rescale(10501, 3, 'USD') is None
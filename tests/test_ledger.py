@@ -0,0 +1,131 @@
+from beancount import loader
+from rich.console import Console
+from bean_import.helpers import Patch
+from bean_import.ledger import ledger_load, ledger_reconcile
+from bean_import.ofx import Transaction, ofx_matches, ofx_rank
+from datetime import datetime
+from decimal import Decimal
+
+MAIN = """option "operating_currency" "USD"
+2024-01-01 open Assets:Bank
+2024-01-01 open Expenses:Food
+2024-01-01 open Income:Salary
+include "txns.bean"
+"""
+
+TXNS = """2024-01-02 * "A"
+  Expenses:Food  10.49 USD
+  Assets:Bank
+
+2024-01-03 * "B"
+  ; comment
+  Assets:Bank  -20 USD
+  Expenses:Food
+
+2024-01-04 * "C" #tag
+  Assets:Bank  1000.00 USD
+    note: "pay"
+  Income:Salary
+
+2024-01-05 * "D"
+  Expenses:Food  5 USD
+  Assets:Bank"""
+
+console = Console(quiet=True)
+
+def write_ledger(tmp_path):
+    (tmp_path / 'main.bean').write_text(MAIN)
+    (tmp_path / 'txns.bean').write_text(TXNS)
+    return ledger_load(console, tmp_path / 'main.bean')
+
+def entry_id(ledger_data, payee):
+    for i in range(len(ledger_data.entry_files)):
+        if ledger_data.bean(i).entry.narration == payee: return i
+
+def recs(path):
+    entries, errors, _ = loader.load_file(str(path))
+    assert not errors
+    return {e.narration: {p.account: p.meta.get('rec') for p in e.postings} for e in entries if hasattr(e, 'postings')}
+
+def test_bean_materialized_from_file(tmp_path):
+    ledger_data = write_ledger(tmp_path)
+    bean = ledger_data.bean(entry_id(ledger_data, 'A'))
+    assert bean.entry.meta['lineno'] == 1
+    assert bean.entry.narration == 'A'
+    # The interpolated amount is filled in from the projection
+    assert str(bean.entry.postings[1].units) == '-10.49 USD'
+    assert bean.amount == 1049
+
+def test_reconcile_shifts_lines(tmp_path):
+    ledger_data = write_ledger(tmp_path)
+    # Reconcile out of file order so later edits land both above and below earlier ones
+    for payee, rec in [('C', 'R3'), ('A', 'R1'), ('D', 'R4'), ('B', 'R2')]:
+        bean = ledger_data.bean(entry_id(ledger_data, payee))
+        assert ledger_reconcile(console, ledger_data, bean, 'Assets:Bank', rec)
+    assert not ledger_data.changed()
+    assert ledger_data.recs >= {'R1', 'R2', 'R3', 'R4'}
+    assert recs(tmp_path / 'main.bean') == {
+        'A': {'Expenses:Food': None, 'Assets:Bank': 'R1'},
+        'B': {'Assets:Bank': 'R2', 'Expenses:Food': None},
+        'C': {'Assets:Bank': 'R3', 'Income:Salary': None},
+        'D': {'Expenses:Food': None, 'Assets:Bank': 'R4'}}
+    # Beans still materialize at the right place after the edits
+    assert ledger_data.bean(entry_id(ledger_data, 'D')).entry.meta['lineno'] == 18
+
+def test_reconcile_only_once(tmp_path):
+    ledger_data = write_ledger(tmp_path)
+    bean = ledger_data.bean(entry_id(ledger_data, 'A'))
+    assert ledger_reconcile(console, ledger_data, bean, 'Assets:Bank', 'R1')
+    assert not ledger_reconcile(console, ledger_data, bean, 'Assets:Bank', 'R2')
+
+def test_reconcile_through_patch(tmp_path):
+    patch = Patch()
+    (tmp_path / 'main.bean').write_text(MAIN)
+    (tmp_path / 'txns.bean').write_text(TXNS)
+    ledger_data = ledger_load(console, tmp_path / 'main.bean', patch)
+    for payee, rec in [('D', 'R4'), ('A', 'R1'), ('C', 'R3')]:
+        bean = ledger_data.bean(entry_id(ledger_data, payee))
+        assert ledger_reconcile(console, ledger_data, bean, 'Assets:Bank', rec, patch)
+    assert (tmp_path / 'txns.bean').read_text() == TXNS
+    assert patch.apply(console)
+    assert recs(tmp_path / 'main.bean')['C'] == {'Assets:Bank': 'R3', 'Income:Salary': None}
+    assert recs(tmp_path / 'main.bean')['D'] == {'Expenses:Food': None, 'Assets:Bank': 'R4'}
+
+def test_matches_within_days(tmp_path):
+    ledger_data = write_ledger(tmp_path)
+    txn = Transaction(id='X', date=datetime(2024, 1, 8), amount=Decimal('-5'), currency='USD')
+    assert [b.entry.narration for b in ofx_matches(txn, ledger_data, 'Assets:Bank')] == ['D']
+    assert ofx_matches(txn, ledger_data, 'Assets:Bank', 2) == []
+    assert len(ofx_matches(txn, ledger_data, 'Assets:Bank', 3)) == 1
+    # Same amount on two entries, ranked closest first
+    txn = Transaction(id='Y', date=datetime(2024, 1, 3), amount=Decimal('10.49'), currency='USD')
+    (tmp_path / 'txns.bean').write_text(TXNS + '\n\n2024-01-03 * "E"\n  Expenses:Food  10.49 USD\n  Assets:Bank\n')
+    ledger_data = ledger_load(console, tmp_path / 'main.bean')
+    assert [b.entry.narration for b in ofx_rank(txn, ofx_matches(txn, ledger_data, 'Assets:Bank'))] == ['E', 'A']
+    assert len(ofx_matches(txn, ledger_data, 'Assets:Bank', 0)) == 1
+
+PLUGIN = """import datetime
+from beancount.core import data
+__plugins__ = ['repeat']
+def repeat(entries, options):
+    # Repeat entry A a month later, keeping its source line
+    return entries + [e._replace(date=e.date + datetime.timedelta(days=30)) for e in entries if isinstance(e, data.Transaction) and e.narration == 'A'], []
+"""
+
+def test_matches_skip_pad_and_plugin_entries(tmp_path, monkeypatch):
+    (tmp_path / 'repeat_a.py').write_text(PLUGIN)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    (tmp_path / 'main.bean').write_text(MAIN.replace('include', 'plugin "repeat_a"\n2024-01-01 open Equity:Open\n2024-01-01 pad Assets:Bank Equity:Open\n2024-01-10 balance Assets:Bank 1000.00 USD\ninclude'))
+    (tmp_path / 'txns.bean').write_text(TXNS)
+    ledger_data = ledger_load(console, tmp_path / 'main.bean')
+    assert not ledger_data.errors
+    # The padding entry is not projected
+    entries, _, _ = loader.load_file(str(tmp_path / 'main.bean'))
+    assert [str(p.units) for e in entries if getattr(e, 'flag', None) == 'P' for p in e.postings][0] == '35.49 USD'
+    txn = Transaction(id='P', date=datetime(2024, 1, 2), amount=Decimal('35.49'), currency='USD')
+    assert len(ledger_data.post_rows('Assets:Bank', 'USD', 3549)) == 0
+    assert ofx_matches(txn, ledger_data, 'Assets:Bank') == []
+    # The plugin copy is projected but can not be read back, only the original matches
+    txn = Transaction(id='A', date=datetime(2024, 2, 1), amount=Decimal('-10.49'), currency='USD')
+    assert len(ledger_data.post_rows('Assets:Bank', 'USD', 1049)) == 2
+    assert [b.entry.date.isoformat() for b in ofx_matches(txn, ledger_data, 'Assets:Bank')] == ['2024-01-02']
@@ -0,0 +1,100 @@
+import os, shutil, subprocess, pytest
+from rich.console import Console
+from bean_import.helpers import Patch, append_lines, replace_lines, get_json, get_key, set_key
+
+console = Console(quiet=True)
+
+ENTRY = '2024-02-07 * "Gas"\n  Expenses:Gas  30.00 USD\n  Assets:Bank\n'
+
+@pytest.mark.parametrize('text', ['', 'a\n', 'a\nb', 'a\x0cb\u2028c\n'])
+def test_append_matches_file_append(tmp_path, text):
+    direct = tmp_path / 'direct.bean'
+    patched = tmp_path / 'patched.bean'
+    direct.write_text(text, encoding='utf-8')
+    patched.write_text(text, encoding='utf-8')
+    patch = Patch()
+    for data in [ENTRY, 'x\x0cy\u2028z']:
+        assert append_lines(console, direct, data)
+        assert append_lines(console, patched, data, patch)
+    lines = patch.lines(patched)
+    assert ''.join(lines) == direct.read_text(encoding='utf-8')
+    # Only newlines end lines, so line numbers match the file
+    assert all(line.endswith('\n') and line.count('\n') == 1 for line in lines[:-1])
+    assert patched.read_text(encoding='utf-8') == text
+
+def test_apply(tmp_path):
+    path = tmp_path / 'txns.bean'
+    path.write_text('a\nb\nc\n')
+    patch = Patch()
+    replace_lines(console, path, 'b\n  rec: "X"', 2, 1, patch)
+    append_lines(console, tmp_path / 'new.bean', ENTRY, patch)
+    assert path.read_text() == 'a\nb\nc\n'
+    assert not (tmp_path / 'new.bean').exists()
+    assert patch.apply(console)
+    assert path.read_text() == 'a\nb\n  rec: "X"\nc\n'
+    assert (tmp_path / 'new.bean').read_text() == '\n' + ENTRY
+    assert not [f for f in os.listdir(tmp_path) if f.startswith('.bean-import-')]
+
+def test_apply_refuses_changed_file(tmp_path):
+    path = tmp_path / 'txns.bean'
+    other = tmp_path / 'other.bean'
+    path.write_text('a\nb\n')
+    other.write_text('c\n')
+    patch = Patch()
+    replace_lines(console, other, 'C', 1, 1, patch)
+    replace_lines(console, path, 'B', 2, 1, patch)
+    path.write_text('a\nb\nedited\n')
+    os.utime(path, ns=(0, 0))
+    assert not patch.apply(console)
+    # Nothing is written when any file changed
+    assert path.read_text() == 'a\nb\nedited\n'
+    assert other.read_text() == 'c\n'
+    assert not [f for f in os.listdir(tmp_path) if f.startswith('.bean-import-')]
+
+@pytest.mark.skipif(shutil.which('git') is None, reason="git not installed")
+def test_diff_applies_with_git(tmp_path):
+    work = tmp_path / 'work'
+    work.mkdir()
+    (work / 'txns.bean').write_text('a\nb\nc')
+    (work / 'main.bean').write_text('x\n')
+    patch = Patch()
+    replace_lines(console, work / 'txns.bean', 'b\n  rec: "X"', 2, 1, patch)
+    append_lines(console, work / 'txns.bean', ENTRY, patch)
+    append_lines(console, work / 'new.bean', ENTRY, patch)
+    diff = patch.diff(work)
+    assert '--- /dev/null\n+++ b/new.bean' in diff
+
+    check = tmp_path / 'check'
+    shutil.copytree(work, check)
+    subprocess.run(['git', 'init', '-q'], cwd=check, check=True)
+    (tmp_path / 'changes.diff').write_text(diff)
+    subprocess.run(['git', 'apply', str(tmp_path / 'changes.diff')], cwd=check, check=True)
+    assert patch.apply(console)
+    for name in ['txns.bean', 'main.bean', 'new.bean']:
+        assert (check / name).read_text() == (work / name).read_text()
+
+def test_save_after_failed_apply(tmp_path):
+    path = tmp_path / 'txns.bean'
+    path.write_text('a\nb\n')
+    patch = Patch()
+    replace_lines(console, path, 'B', 2, 1, patch)
+    path.write_text('a\nb\nedited\n')
+    os.utime(path, ns=(0, 0))
+    assert not patch.apply(console)
+    diff_path = patch.save(console, tmp_path)
+    assert os.path.dirname(diff_path) == str(tmp_path)
+    with open(diff_path, encoding='utf-8') as file:
+        assert file.read() == patch.diff(tmp_path)
+    assert '+B\n' in patch.diff(tmp_path)
+
+def test_json_in_patch(tmp_path):
+    path = tmp_path / 'payees.json'
+    patch = Patch()
+    assert get_key(path, 'CAFE', patch) is None
+    set_key(path, 'CAFE', 'Café Bar', patch)
+    set_key(path, 'GAS', 'Gas', patch)
+    assert get_key(path, 'CAFE', patch) == 'Café Bar'
+    # Missing files are neither created nor written until applied
+    assert not path.exists()
+    assert patch.apply(console)
+    assert get_json(path) == {'CAFE': 'Café Bar', 'GAS': 'Gas'}
@@ -0,0 +1,180 @@
+import json, os, tempfile, threading, pytest
+from beancount import loader
+from rich.console import Console
+from bean_import.ledger import ledger_load
+from bean_import.server import State, RequestError, RWLock
+
+MAIN = """option "operating_currency" "USD"
+2024-01-01 open Assets:Checking
+2024-01-01 open Expenses:Food
+2024-01-01 open Expenses:Gas
+2024-01-01 open Income:Salary
+include "txns.bean"
+"""
+
+TXNS = """2024-02-01 * "Grocer" "food"
+  Expenses:Food  12.50 USD
+  Assets:Checking
+
+2024-02-03 * "Cafe" ""
+  Expenses:Food  4.25 USD
+  Assets:Checking  -4.25 USD
+"""
+
+OFX = b"""OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+SECURITY:NONE
+ENCODING:USASCII
+CHARSET:1252
+COMPRESSION:NONE
+OLDFILEUID:NONE
+NEWFILEUID:NONE
+
+<OFX><SIGNONMSGSRSV1><SONRS><STATUS><CODE>0<SEVERITY>INFO</STATUS><DTSERVER>20240210<LANGUAGE>ENG</SONRS></SIGNONMSGSRSV1>
+<BANKMSGSRSV1><STMTTRNRS><TRNUID>1<STATUS><CODE>0<SEVERITY>INFO</STATUS><STMTRS><CURDEF>USD<BANKACCTFROM><BANKID>1<ACCTID>999<ACCTTYPE>CHECKING</BANKACCTFROM>
+<BANKTRANLIST><DTSTART>20240101<DTEND>20240210
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240201<TRNAMT>-12.50<FITID>A1<NAME>GROCER 123</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240203<TRNAMT>-4.25<FITID>A2<NAME>CAFE</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240207<TRNAMT>-30.00<FITID>A4<NAME>GAS</STMTTRN>
+</BANKTRANLIST><LEDGERBAL><BALAMT>0<DTASOF>20240210</LEDGERBAL></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+CSV = b"""Date,Description,Amount
+2024-02-01,GROCER 123,-12.50
+2024-02-07,GAS,-30.00
+"""
+
+BANKS = {"bank": {"account_id": "999", "columns": {"date": "Date", "payee": "Description", "amount": "Amount"}}}
+
+console = Console(quiet=True)
+
+def start(tmp_path, output=True):
+    (tmp_path / 'main.bean').write_text(MAIN)
+    (tmp_path / 'txns.bean').write_text(TXNS)
+    (tmp_path / 'banks.json').write_text(json.dumps(BANKS))
+    ledger_data = ledger_load(console, tmp_path / 'main.bean')
+    state = State(console, tmp_path / 'main.bean', ledger_data, tmp_path / 'payees.json', tmp_path / 'txns.bean' if output else None, '*', tmp_path / 'banks.json')
+    session = state.session(state.upload(OFX, 'Assets:Checking', '')['session'])
+    return state, session
+
+def status(call, *args):
+    with pytest.raises(RequestError) as e:
+        call(*args)
+    return e.value.status
+
+def recs(path):
+    entries, errors, _ = loader.load_file(str(path))
+    assert not errors
+    return {e.payee: [p.meta.get('rec') for p in e.postings if p.account == 'Assets:Checking'] for e in entries if hasattr(e, 'postings')}
+
+def test_upload_csv(tmp_path):
+    state, session = start(tmp_path)
+    summary = state.upload(CSV, 'Assets:Checking', '', 'CSV', 'bank')
+    session = state.session(summary['session'])
+    assert summary['account_id'] == '999'
+    assert sorted(t.payee for t in session.pending.values()) == ['GAS', 'GROCER 123']
+    txn = next(t for t in session.pending.values() if t.payee == 'GROCER 123')
+    key, bean = state.matches(session, txn)[0]
+    state.reconcile(session, txn.id, key)
+    assert recs(tmp_path / 'main.bean')['Grocer'] == [txn.id]
+
+@pytest.mark.parametrize('body, format, bank, error', [
+    (CSV, 'csv', '', "Please specify the ?bank="),
+    (CSV, 'csv', 'other', "Bank 'other' not found"),
+    (CSV, 'xls', '', "Unsupported statement format 'xls'"),
+    (b'Date,Description,Amount\nyesterday,GAS,-30.00\n', 'csv', 'bank', "Error parsing statement file"),
+    (b'not ofx', 'ofx', '', "Error parsing OFX file")
+])
+def test_upload_errors(tmp_path, body, format, bank, error):
+    state, session = start(tmp_path)
+    with pytest.raises(RequestError) as e:
+        state.upload(body, 'Assets:Checking', '', format, bank)
+    assert e.value.status == 400
+    assert error in str(e.value)
+    assert len(state.sessions) == 1
+    # Temporary statement files are removed
+    assert not [f for f in os.listdir(tempfile.gettempdir()) if f.startswith('bean-import-') and f.endswith(f'.{format}')]
+
+def test_reconcile_refuses_stale_match(tmp_path):
+    state, session = start(tmp_path)
+    key, bean = state.matches(session, session.txn('A1'))[0]
+
+    # An edit outside of the server reloads the ledger, the old key points at old line numbers
+    txns = tmp_path / 'txns.bean'
+    txns.write_text('; moved\n' + TXNS)
+    os.utime(txns, ns=(0, 0))
+    assert status(state.reconcile, session, 'A1', key) == 409
+    assert status(state.reconcile, session, 'A1', '99:0') == 409
+    assert 'A1' in session.pending
+
+    key, bean = state.matches(session, session.txn('A1'))[0]
+    state.reconcile(session, 'A1', key)
+    assert recs(tmp_path / 'main.bean')['Grocer'] == ['A1']
+    assert 'A1' not in session.pending
+    # Reconciled once, a second time is refused
+    assert status(state.reconcile, session, 'A1', key) == 404
+
+@pytest.mark.parametrize('postings', [
+    [{"account": "Assets:Checking", "amount": "-30.00"}, {"account": "Expenses:Gas", "amount": "20"}],
+    [{"account": "Assets:Checking", "amount": "-30.00"}, "Expenses:Gas"],
+    [{"account": "Assets:Checking", "amount": "-30.00"}, {"account": "gas", "amount": "30"}],
+    [{"account": "Assets:Checking", "amount": "-3e1"}, {"account": "Expenses:Gas", "amount": "30"}],
+    [{"account": "Assets:Checking", "amount": "-15*2"}, {"account": "Expenses:Gas", "amount": "30"}],
+    [{"account": "Assets:Checking", "amount": "-30.001"}, {"account": "Expenses:Gas", "amount": "30.001"}],
+    [{"account": "Assets:Checking", "amount": True}, {"account": "Expenses:Gas", "amount": "30"}],
+    []
+])
+def test_insert_rejects_invalid_postings(tmp_path, postings):
+    state, session = start(tmp_path)
+    assert status(state.insert, session, 'A4', {"id": "A4", "postings": postings}) == 400
+    assert (tmp_path / 'txns.bean').read_text() == TXNS
+    assert 'A4' in session.pending
+
+def test_insert(tmp_path):
+    state, session = start(tmp_path)
+    state.insert(session, 'A4', {"id": "A4", "payee": "Gas Station", "postings": [
+        {"account": "Expenses:Gas", "amount": "30"},
+        {"account": "Assets:Checking", "amount": -30}]})
+    assert recs(tmp_path / 'main.bean')['Gas Station'] == ['A4']
+    assert 'A4' in state.ledger_data.recs
+    assert 'A4' not in session.pending
+
+def test_insert_without_account_needs_force(tmp_path):
+    state, session = start(tmp_path)
+    data = {"id": "A4", "postings": [
+        {"account": "Expenses:Gas", "amount": "30"},
+        {"account": "Expenses:Food", "amount": "-30"}]}
+    assert status(state.insert, session, 'A4', data) == 400
+    assert (tmp_path / 'txns.bean').read_text() == TXNS
+
+    state.insert(session, 'A4', {**data, "force": True})
+    assert recs(tmp_path / 'main.bean')['GAS'] == []
+    assert 'A4' not in state.ledger_data.recs
+    assert 'A4' not in session.pending
+
+def test_insert_needs_output(tmp_path):
+    state, session = start(tmp_path, output=False)
+    data = {"id": "A4", "postings": [
+        {"account": "Expenses:Gas", "amount": "30"},
+        {"account": "Assets:Checking", "amount": "-30"}]}
+    assert status(state.insert, session, 'A4', data) == 400
+    assert (tmp_path / 'txns.bean').read_text() == TXNS
+
+def test_rwlock_shares_reads():
+    lock = RWLock()
+    done = {name: threading.Event() for name in ('reader', 'writer', 'late reader')}
+
+    def hold(name, mode):
+        with getattr(lock, mode)(): done[name].set()
+
+    with lock.read():
+        threading.Thread(target=hold, args=('reader', 'read')).start()
+        assert done['reader'].wait(5)
+        # A writer waits for readers, and readers arriving after it wait for the writer
+        threading.Thread(target=hold, args=('writer', 'write')).start()
+        assert not done['writer'].wait(0.2)
+        threading.Thread(target=hold, args=('late reader', 'read')).start()
+        assert not done['late reader'].wait(0.2)
+    assert done['writer'].wait(5)
+    assert done['late reader'].wait(5)
@@ -0,0 +1,63 @@
+from rich.console import Console
+from bean_import.statement import csv_load, csv_amount
+from decimal import Decimal
+
+console = Console(quiet=True)
+
+def load(tmp_path, text, config, name='export.csv', precisions=None):
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    config = {'account_id': 'bank-1', **config}
+    return csv_load(console, path, config, 'USD', precisions)
+
+def test_csv_amount():
+    assert csv_amount('1,234.50') == Decimal('1234.50')
+    assert csv_amount('(12.00)') == Decimal('-12.00')
+    assert csv_amount('1.234,50', ',') == Decimal('1234.50')
+    assert csv_amount('') == 0
+
+def test_amount_sign(tmp_path):
+    text = "Date,Payee,Amount\n2024-02-01,CAFE,4.25\n"
+    config = {'columns': {'date': 'Date', 'payee': 'Payee', 'amount': 'Amount'}}
+    assert [t.amount for t in load(tmp_path, text, config).transactions] == [425]
+    assert [t.amount for t in load(tmp_path, text, {**config, 'sign': 'inverted'}).transactions] == [-425]
+
+def test_decimal_separator(tmp_path):
+    text = "Date;Payee;Amount\n01/02/2024;CAFE;-1.234,5\n"
+    config = {'columns': {'date': 'Date', 'payee': 'Payee', 'amount': 'Amount'}, 'delimiter': ';', 'decimal': ',', 'date_format': '%d/%m/%Y'}
+    txn = next(iter(load(tmp_path, text, config).transactions))
+    assert (txn.date, txn.amount, txn.precision) == ('2024-02-01', -123450, 2)
+
+def test_debit_credit(tmp_path):
+    text = "Posted,Description,Debit,Credit\n02/01/2024,GROCER,12.50,\n02/05/2024,EMPLOYER,,\"1,000.00\"\n"
+    config = {'columns': {'date': 'Posted', 'payee': 'Description', 'debit': 'Debit', 'credit': 'Credit'}, 'date_format': '%m/%d/%Y'}
+    assert [(t.payee, t.amount) for t in load(tmp_path, text, config).transactions] == [('GROCER', -1250), ('EMPLOYER', 100000)]
+
+def test_index_columns(tmp_path):
+    text = "Date,Payee,Amount\n2024-02-01,CAFE,-4.25\n"
+    columns = {'date': 0, 'payee': 1, 'amount': 2}
+    assert [t.amount for t in load(tmp_path, text, {'columns': columns}).transactions] == [-425]
+    assert [t.amount for t in load(tmp_path, text.split('\n', 1)[1], {'columns': columns, 'header': False}).transactions] == [-425]
+    # Names need a header row, and must be in it
+    assert load(tmp_path, text, {'columns': {'date': 'Date', 'payee': 'Payee', 'amount': 'Amount'}, 'header': False}) is None
+    assert load(tmp_path, text, {'columns': {'date': 'Date', 'payee': 'Payee', 'amount': 'Total'}}) is None
+
+def test_account_id_required(tmp_path):
+    path = tmp_path / 'export.csv'
+    path.write_text("Date,Payee,Amount\n")
+    assert csv_load(console, path, {'columns': {'date': 'Date', 'payee': 'Payee', 'amount': 'Amount'}}) is None
+
+def test_stable_ids(tmp_path):
+    text = "Date,Payee,Amount\n2024-02-01,CAFE,-4.25\n2024-02-01,CAFE,-4.25\n2024-02-02,CAFE,-4.25\n"
+    config = {'columns': {'date': 'Date', 'payee': 'Payee', 'amount': 'Amount'}}
+    ids = [t.id for t in load(tmp_path, text, config).transactions]
+    assert len(set(ids)) == 3
+    # Same rows in a differently named daily export, or read with another precision, keep their ids
+    assert [t.id for t in load(tmp_path, text, config, name='export-2024-02-03.csv').transactions] == ids
+    assert [t.id for t in load(tmp_path, text, config, precisions={'USD': 3}).transactions] == ids
+    assert [t.id for t in load(tmp_path, text.replace('-4.25', '-4.250'), config).transactions] == ids
+    # Another account does not share them
+    assert [t.id for t in load(tmp_path, text, {**config, 'account_id': 'bank-2'}).transactions] != ids
+    # A bank id column wins
+    text = "Id,Date,Payee,Amount\nT1,2024-02-01,CAFE,-4.25\n"
+    assert [t.id for t in load(tmp_path, text, {'columns': {**config['columns'], 'id': 'Id'}}).transactions] == ['T1']
@@ -0,0 +1,142 @@
+import json
+from rich.console import Console
+from bean_import import watch
+from bean_import.helpers import Patch
+from bean_import.ledger import ledger_load
+from bean_import.watch import Watcher, watch_file
+
+MAIN = """option "operating_currency" "USD"
+2024-01-01 open Assets:Checking
+2024-01-01 open Expenses:Food
+2024-01-01 open Income:Salary
+include "txns.bean"
+"""
+
+TXNS = """2024-02-01 * "Grocer"
+  Expenses:Food  12.50 USD
+  Assets:Checking
+
+2024-02-03 * "Cafe"
+  Expenses:Food  4.25 USD
+  Assets:Checking
+
+2024-02-04 * "Bakery"
+  Expenses:Food  4.25 USD
+  Assets:Checking
+
+2024-02-05 * "Employer"
+  Assets:Checking  1000.00 USD
+    rec: "A3"
+  Income:Salary
+"""
+
+HEADER = """OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+SECURITY:NONE
+ENCODING:USASCII
+CHARSET:1252
+COMPRESSION:NONE
+OLDFILEUID:NONE
+NEWFILEUID:NONE
+
+<OFX><SIGNONMSGSRSV1><SONRS><STATUS><CODE>0<SEVERITY>INFO</STATUS><DTSERVER>20240210<LANGUAGE>ENG</SONRS></SIGNONMSGSRSV1>
+<BANKMSGSRSV1><STMTTRNRS><TRNUID>1<STATUS><CODE>0<SEVERITY>INFO</STATUS><STMTRS><CURDEF>USD<BANKACCTFROM><BANKID>1<ACCTID>999<ACCTTYPE>CHECKING</BANKACCTFROM>
+<BANKTRANLIST><DTSTART>20240101<DTEND>20240210
+"""
+
+FOOTER = """</BANKTRANLIST><LEDGERBAL><BALAMT>0<DTASOF>20240210</LEDGERBAL></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+console = Console(quiet=True)
+
+def ofx(path, txns):
+    rows = ''.join(f"<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>{d}<TRNAMT>{a}<FITID>{i}<NAME>{n}</STMTTRN>\n" for i, d, a, n in txns)
+    path.write_text(HEADER + rows + FOOTER)
+
+def write_ledger(tmp_path):
+    (tmp_path / 'main.bean').write_text(MAIN)
+    (tmp_path / 'txns.bean').write_text(TXNS)
+    return ledger_load(console, tmp_path / 'main.bean')
+
+def test_ready_waits_for_debounce(tmp_path, monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(watch.time, 'monotonic', lambda: clock[0])
+    (tmp_path / 'a.ofx').write_text('a')
+    (tmp_path / 'notes.txt').write_text('a')
+    watcher = Watcher(tmp_path, 5)
+
+    assert watcher.ready() == []
+    clock[0] += 4.9
+    assert watcher.ready() == []
+    clock[0] += 0.1
+    assert watcher.ready() == [tmp_path / 'a.ofx']
+    # Parsed once until it changes
+    clock[0] += 10
+    assert watcher.ready() == []
+
+    # A change restarts the wait
+    (tmp_path / 'a.ofx').write_text('ab')
+    assert watcher.ready() == []
+    clock[0] += 3
+    (tmp_path / 'a.ofx').write_text('abc')
+    clock[0] += 3
+    assert watcher.ready() == []
+    clock[0] += 4.9
+    assert watcher.ready() == []
+    clock[0] += 0.1
+    assert watcher.ready() == [tmp_path / 'a.ofx']
+
+def test_ready_without_debounce(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch.time, 'monotonic', lambda: 0.0)
+    (tmp_path / 'a.QFX').write_text('a')
+    (tmp_path / 'b.csv').write_text('b')
+    watcher = Watcher(tmp_path, 0)
+    assert watcher.ready() == [tmp_path / 'a.QFX', tmp_path / 'b.csv']
+    assert watcher.ready() == []
+
+def test_watch_file_reconciles_or_queues(tmp_path, monkeypatch):
+    ledger_data = write_ledger(tmp_path)
+    statement = tmp_path / 'bank.ofx'
+    ofx(statement, [
+        ('A1', '20240201', '-12.50', 'GROCER'),
+        ('A2', '20240203', '-4.25', 'CAFE'),
+        ('A3', '20240205', '1000.00', 'EMPLOYER'),
+        ('A4', '20240207', '-30.00', 'GAS'),
+        ('A5', '20240220', '-4.25', 'CAFE')])
+    review = tmp_path / 'review.json'
+    # A1 was queued before and is reconciled now, A3 was reconciled since it was queued
+    review.write_text(json.dumps({'A1': {}, 'A3': {}, 'Z9': {'payee': 'OLD'}}))
+
+    writes = []
+    set_json = watch.set_json
+    monkeypatch.setattr(watch, 'set_json', lambda *args: writes.append(args) or set_json(*args))
+    assert watch_file(console, console, statement, ledger_data, 'Assets:Checking', review, 7) == (1, 3)
+
+    # Only a single match is reconciled, A5 has two but none within 7 days
+    assert '    rec: "A1"\n' in (tmp_path / 'txns.bean').read_text()
+    queued = json.loads(review.read_text())
+    assert sorted(queued) == ['A2', 'A4', 'A5', 'Z9']
+    assert queued['A2']['matches'] == 2
+    assert queued['A4'] == {
+        "file": str(statement),
+        "account": "Assets:Checking",
+        "date": "2024-02-07",
+        "payee": "GAS",
+        "amount": "-30.00",
+        "matches": 0}
+    assert queued['A5']['matches'] == 0
+    # Written once per statement file
+    assert len(writes) == 1
+
+def test_watch_file_patch(tmp_path):
+    write_ledger(tmp_path)
+    statement = tmp_path / 'bank.ofx'
+    ofx(statement, [('A1', '20240201', '-12.50', 'GROCER'), ('A4', '20240207', '-30.00', 'GAS')])
+    patch = Patch()
+    ledger_data = ledger_load(console, tmp_path / 'main.bean', patch)
+    assert watch_file(console, console, statement, ledger_data, 'Assets:Checking', tmp_path / 'review.json', 7, patch=patch) == (1, 1)
+    assert (tmp_path / 'txns.bean').read_text() == TXNS
+    assert not (tmp_path / 'review.json').exists()
+    assert patch.apply(console)
+    assert sorted(json.loads((tmp_path / 'review.json').read_text())) == ['A4']